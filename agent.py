@@ -0,0 +1,112 @@
+#!/usr/bin/python
+import base64
+import json
+import time
+
+import libvirt
+import libvirt_qemu
+
+import virt
+
+# Seconds libvirt waits for qemu-ga to answer a single command.
+COMMAND_TIMEOUT = 10
+EXEC_POLL_INTERVAL = 0.05
+# Seconds a guest-exec command may run before execute() gives up on it.
+EXEC_TIMEOUT = 600
+READ_SIZE = 2 ** 20
+REQUIRED_COMMANDS = (
+    'guest-exec',
+    'guest-exec-status',
+    'guest-file-open',
+    'guest-file-read',
+    'guest-file-close',
+)
+
+
+class AgentError(Exception):
+    pass
+
+
+class Agent(object):
+    # Commands and file reads through the qemu guest agent, over the
+    # virtio-serial channel set up by domain.build.
+    def __init__(self, name):
+        self.name = name
+
+    def command(self, execute, **arguments):
+        request = {'execute': execute}
+        if arguments:
+            request['arguments'] = arguments
+        try:
+            reply = libvirt_qemu.qemuAgentCommand(
+                virt.get_conn().lookupByName(self.name),
+                json.dumps(request),
+                COMMAND_TIMEOUT,
+                0,
+            )
+        except libvirt.libvirtError as e:
+            raise AgentError('%s: %s' % (execute, e))
+        return json.loads(reply)['return']
+
+    def execute(self, argv, timeout=EXEC_TIMEOUT):
+        # Returns (exit code, stdout, stderr) like VM.ssh; a command killed
+        # by a signal gets minus the signal number.
+        pid = self.command('guest-exec', path=argv[0], arg=argv[1:],
+                           **{'capture-output': True})['pid']
+        deadline = time.time() + timeout
+        while True:
+            status = self.command('guest-exec-status', pid=pid)
+            if status['exited']:
+                break
+            if time.time() > deadline:
+                self._kill(pid)
+                raise AgentError('guest-exec: %s still running after %d '
+                                 'seconds' % (argv[0], timeout))
+            time.sleep(EXEC_POLL_INTERVAL)
+        if 'exitcode' in status:
+            returncode = status['exitcode']
+        else:
+            returncode = -status['signal']
+        return (
+            returncode,
+            base64.b64decode(status.get('out-data', '')),
+            base64.b64decode(status.get('err-data', '')),
+        )
+
+    def _kill(self, pid):
+        # qemu-ga has no command to stop what guest-exec started.
+        try:
+            self.command('guest-exec', path='/bin/kill',
+                         arg=['-KILL', str(pid)])
+        except AgentError:
+            pass
+
+    def read_file(self, path):
+        handle = self.command('guest-file-open', path=path, mode='r')
+        chunks = []
+        try:
+            while True:
+                reply = self.command('guest-file-read', handle=handle,
+                                     count=READ_SIZE)
+                chunks.append(base64.b64decode(reply['buf-b64']))
+                if reply['eof']:
+                    break
+        finally:
+            self.command('guest-file-close', handle=handle)
+        return ''.join(chunks)
+
+
+def connect(name):
+    # None if the guest runs no agent, or one without guest-exec (qemu-ga
+    # before 2.5); the caller falls back to ssh.
+    agent = Agent(name)
+    try:
+        info = agent.command('guest-info')
+    except AgentError:
+        return None
+    enabled = set(
+        c['name'] for c in info['supported_commands'] if c['enabled']
+    )
+    if not enabled.issuperset(REQUIRED_COMMANDS):
+        return None
+    return agent
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+import hashlib
+import os
+import tempfile
+import zlib
+
+import gridfs
+import pymongo
+
+BLOB_PATH = '/home/dkuznets/projects/school/apf-blobs'
+# 'local' or 'gridfs'
+BACKEND = 'local'
+# Strings longer than this are moved out of result documents.
+THRESHOLD = 4096
+COMPRESS_LEVEL = 6
+
+
+class LocalBlobStore(object):
+    def __init__(self, path=BLOB_PATH):
+        self.path = path
+
+    def _path(self, digest):
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def __contains__(self, digest):
+        return os.path.exists(self._path(digest))
+
+    def put(self, digest, data):
+        if digest in self:
+            return
+        dirname = os.path.dirname(self._path(digest))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(data, COMPRESS_LEVEL))
+        os.rename(tmp_path, self._path(digest))
+
+    def get(self, digest):
+        with open(self._path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+
+class GridFSBlobStore(object):
+    def __init__(self, db=None):
+        if db is None:
+            db = pymongo.MongoClient()['apf']
+        self._fs = gridfs.GridFS(db, 'blobs')
+
+    def __contains__(self, digest):
+        return self._fs.exists(digest)
+
+    def put(self, digest, data):
+        if digest in self:
+            return
+        self._fs.put(zlib.compress(data, COMPRESS_LEVEL), _id=digest)
+
+    def get(self, digest):
+        return zlib.decompress(self._fs.get(digest).read())
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = {
+            'local': LocalBlobStore,
+            'gridfs': GridFSBlobStore,
+        }[BACKEND]()
+    return _store
+
+
+is_ref = lambda x: isinstance(x, dict) and '_blob' in x
+
+
+def put_string(store, value):
+    is_unicode = isinstance(value, unicode)
+    data = is_unicode and value.encode('utf-8') or value
+    digest = hashlib.sha1(data).hexdigest()
+    store.put(digest, data)
+    return {'_blob': digest, 'size': len(data), 'unicode': is_unicode}
+
+
+def get_string(store, ref):
+    data = store.get(ref['_blob'])
+    return ref['unicode'] and data.decode('utf-8') or data
+
+
+def externalize(doc, store, threshold=THRESHOLD):
+    # Replaces long strings in doc, in place, with blob references;
+    # returns how many were moved.
+    moved = 0
+    items = isinstance(doc, dict) and doc.items() or enumerate(doc)
+    for k, v in items:
+        if isinstance(v, basestring) and len(v) > threshold:
+            doc[k] = put_string(store, v)
+            moved += 1
+        elif isinstance(v, (dict, list)) and not is_ref(v):
+            moved += externalize(v, store, threshold)
+    return moved
+
+
+def resolve(doc, store):
+    if is_ref(doc):
+        return get_string(store, doc)
+    if not isinstance(doc, (dict, list)):
+        return doc
+    items = isinstance(doc, dict) and doc.items() or enumerate(doc)
+    for k, v in items:
+        if is_ref(v):
+            doc[k] = get_string(store, v)
+        elif isinstance(v, (dict, list)):
+            resolve(v, store)
+    return doc
+
+
+def migrate(coll, store):
+    # Moves the payloads of documents written before the blob store.
+    moved = 0
+    for doc in coll.find():
+        if externalize(doc, store):
+            coll.save(doc)
+            moved += 1
+    print 'externalized %d documents' % moved
+
+
+if __name__ == '__main__':
+    db = pymongo.MongoClient()['apf']
+    migrate(db['results'], get_store())
+    migrate(db['failures'], get_store())
@@ -0,0 +1,72 @@
+import json
+
+DICTIONARY_COLUMNS = ('type', 'axes', 'test.name')
+INT32_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+
+def flatten(record, prefix=''):
+    for key, value in record.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            for item in flatten(value, path + '.'):
+                yield item
+        else:
+            yield path, value
+
+
+def column_dtype(path, values):
+    # Lists and other nested values have no column layout: fail instead of
+    # writing them out as NaN.
+    present = [v for v in values if v is not None]
+    if any(isinstance(v, basestring) for v in present):
+        return 'string'
+    if present and all(isinstance(v, bool) for v in present):
+        return 'bool'
+    for v in present:
+        if isinstance(v, bool) or not isinstance(v, (int, long, float)):
+            raise TypeError('column %s: unsupported value %r' % (path, v))
+    if len(present) == len(values) and all(
+        isinstance(v, (int, long)) and
+        INT32_RANGE[0] <= v <= INT32_RANGE[1]
+        for v in present
+    ):
+        return 'int32'
+    return 'float64'
+
+
+def dictionary_encode(values):
+    dictionary = sorted(set(values))
+    codes = {v: i for i, v in enumerate(dictionary)}
+    dtype = len(dictionary) <= 2 ** 8 and 'uint8' or 'uint16'
+    return dictionary, dtype, [codes[v] for v in values]
+
+
+def to_columns(records):
+    paths = set()
+    flat_records = []
+    for record in records:
+        flat = dict(flatten(record))
+        paths.update(flat)
+        flat_records.append(flat)
+
+    table = {
+        'length': len(flat_records),
+        'dictionaries': {},
+        'dtypes': {},
+        'columns': {},
+    }
+    for path in sorted(paths):
+        values = [flat.get(path) for flat in flat_records]
+        if path in DICTIONARY_COLUMNS:
+            dictionary, dtype, values = dictionary_encode(values)
+            table['dictionaries'][path] = dictionary
+        else:
+            dtype = column_dtype(path, values)
+        table['dtypes'][path] = dtype
+        table['columns'][path] = values
+    return table
+
+
+def export_columnar(path, records):
+    with open(path, 'w') as f:
+        json.dump(to_columns(records), f, separators=(',', ':'))
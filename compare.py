@@ -0,0 +1,107 @@
+import math
+
+import numpy as np
+
+import stats
+
+TUKEY_K = 1.5
+
+
+def to_array(values):
+    return np.array([v for v in values if v is not None], dtype=np.float64)
+
+
+def rankdata(values):
+    order = np.argsort(values, kind='mergesort')
+    sorted_values = values[order]
+    # Average the ranks of tied values.
+    boundaries = np.concatenate((
+        [True], sorted_values[1:] != sorted_values[:-1], [True]
+    ))
+    starts = np.nonzero(boundaries)[0]
+    sizes = np.diff(starts)
+    avg_ranks = starts[:-1] + (sizes + 1) / 2.0
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(avg_ranks, sizes)
+    return ranks, sizes
+
+
+def mann_whitney(x, y):
+    n1, n2 = len(x), len(y)
+    ranks, ties = rankdata(np.concatenate((x, y)))
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2.0
+    n = n1 + n2
+    tie_term = (ties ** 3 - ties).sum() / float(n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - tie_term))
+    if not sigma:
+        return u, 1.0
+    delta = u - n1 * n2 / 2.0
+    z = (abs(delta) - 0.5) / sigma
+    return u, min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+def bootstrap_diff(x, y, samples=stats.BOOTSTRAP_SAMPLES,
+                   confidence=stats.CONFIDENCE, seed=0):
+    rng = np.random.RandomState(seed)
+    bx = x[rng.randint(0, len(x), (samples, len(x)))]
+    by = y[rng.randint(0, len(y), (samples, len(y)))]
+    tail = (1 - confidence) / 2 * 100
+    out = {}
+    for name, func in (('mean', np.mean), ('median', np.median)):
+        diffs = func(by, axis=1) - func(bx, axis=1)
+        low, high = np.percentile(diffs, [tail, 100 - tail])
+        out[name] = {
+            'diff': float(func(y) - func(x)),
+            'ci_low': float(low),
+            'ci_high': float(high),
+        }
+    return out
+
+
+def effect_sizes(x, y, u):
+    n1, n2 = len(x), len(y)
+    pooled = math.sqrt(
+        ((n1 - 1) * x.var(ddof=1) + (n2 - 1) * y.var(ddof=1)) /
+        float(n1 + n2 - 2)
+    )
+    return {
+        # P(y > x) - P(y < x): positive means y (without fix) is larger.
+        'cliffs_delta': float(1 - 2 * u / float(n1 * n2)),
+        'hodges_lehmann': float(np.median(np.subtract.outer(y, x))),
+        'cohens_d': pooled and float((y.mean() - x.mean()) / pooled) or 0.0,
+    }
+
+
+def outliers(values, ids):
+    q1, q3 = np.percentile(values, [25, 75])
+    low = q1 - TUKEY_K * (q3 - q1)
+    high = q3 + TUKEY_K * (q3 - q1)
+    mask = (values < low) | (values > high)
+    return [ids[i] for i in np.nonzero(mask)[0]]
+
+
+def compare(x, y, x_ids, y_ids):
+    # x is the baseline (with fix), y the candidate (without fix).
+    if len(x) < 2 or len(y) < 2:
+        return {'n': [len(x), len(y)]}
+    u, p = mann_whitney(x, y)
+    return {
+        'n': [len(x), len(y)],
+        'mann_whitney': {'u': float(u), 'p': p},
+        'bootstrap': bootstrap_diff(x, y),
+        'effect': effect_sizes(x, y, u),
+        'outliers': [outliers(x, x_ids), outliers(y, y_ids)],
+    }
+
+
+def compare_cell(base, other, metric):
+    # base/other: lists of (id, {metric: value})
+    pairs = []
+    for results in (base, other):
+        kept = [(i, m[metric]) for i, m in results if m[metric] is not None]
+        pairs.append((
+            [i for i, _ in kept],
+            to_array(v for _, v in kept),
+        ))
+    (x_ids, x), (y_ids, y) = pairs
+    return compare(x, y, x_ids, y_ids)
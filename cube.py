@@ -0,0 +1,51 @@
+import json
+
+import stats
+
+CUBE_METRICS = {
+    'duration': lambda r: r['test']['results']['duration'],
+    'events': lambda r: r['events']['total'],
+    'host_swap_read': lambda r: r['disk_activity']['host']['swap']['read'],
+    'host_swap_write': lambda r: r['disk_activity']['host']['swap']['write'],
+}
+
+
+def build_cube(records):
+    cells = {}
+    for res in records:
+        key = (res['test']['name'], res['type'], res['axes'],
+               res['memory']['effective'])
+        cells.setdefault(key, []).append(res)
+
+    summaries = stats.aggregate_cells({
+        (key, name): map(metric, results)
+        for key, results in cells.items()
+        for name, metric in CUBE_METRICS.items()
+    })
+
+    cube = []
+    for key, results in sorted(cells.items()):
+        test, type_, axes, memory = key
+        cube.append({
+            'test': test,
+            'type': type_,
+            'axes': axes,
+            'memory': memory,
+            'count': len(results),
+            'metrics': {
+                name: summaries[(key, name)] for name in CUBE_METRICS
+            },
+        })
+    return cube
+
+
+def export_cube(path, records):
+    with open(path, 'w') as f:
+        json.dump(
+            {
+                'metrics': sorted(CUBE_METRICS),
+                'cells': build_cube(records),
+            },
+            f,
+            separators=(',', ':'),
+        )
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+import copy
+import os
+import threading
+import xml.etree.ElementTree as ET
+
+TEMPLATE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'dom_template.xml',
+)
+
+DISK_BUSES = {
+    # bus: (target device, controller model)
+    'virtio': ('vda', None),
+    'scsi': ('sda', 'virtio-scsi'),
+}
+
+# qemu-ga's virtio-serial socket; libvirt's own directory carries the
+# labels qemu needs to create it.
+AGENT_SOCKET_FMT = '/var/lib/libvirt/qemu/%s.agent'
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def load_template(path=TEMPLATE_PATH):
+    # Parsed once per template file (and again only if it changes); every
+    # caller gets its own copy of the tree.
+    mtime = os.path.getmtime(path)
+    with _templates_lock:
+        cached = _templates.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _templates[path] = (mtime, ET.parse(path).getroot())
+    return copy.deepcopy(cached[1])
+
+
+def insert_after(root, sibling, elem):
+    root.insert(list(root).index(root.find(sibling)) + 1, elem)
+
+
+def set_cpus(root, spec):
+    # At the template's vCPU count its topology (1 vCPU, 2 cores) is kept
+    # as it is, so default runs get the same guest as before.
+    vcpu = root.find('vcpu')
+    if vcpu.text != str(spec['vcpus']):
+        vcpu.text = str(spec['vcpus'])
+        root.find('cpu/topology').set('cores', str(spec['vcpus']))
+
+    cputune = ET.Element('cputune')
+    if isinstance(spec['cpuset'], basestring):
+        vcpu.set('cpuset', spec['cpuset'])
+    elif spec['cpuset'] is not None:
+        for i, cpu in enumerate(spec['cpuset']):
+            ET.SubElement(cputune, 'vcpupin', vcpu=str(i), cpuset=str(cpu))
+    if spec['emulator_cpuset'] is not None:
+        ET.SubElement(cputune, 'emulatorpin',
+                      cpuset=str(spec['emulator_cpuset']))
+    if len(cputune):
+        insert_after(root, 'vcpu', cputune)
+
+    if spec['numa_nodeset'] is not None:
+        numatune = ET.Element('numatune')
+        ET.SubElement(numatune, 'memory', mode=spec['numa_mode'],
+                      nodeset=str(spec['numa_nodeset']))
+        insert_after(root, 'vcpu', numatune)
+
+
+def set_memory(root, mem_size, spec):
+    root.find('memory').text = str(mem_size)
+    root.find('currentMemory').text = str(mem_size)
+
+    backing = ET.Element('memoryBacking')
+    if spec['hugepages']:
+        ET.SubElement(backing, 'hugepages')
+    if spec['ksm'] is False:
+        ET.SubElement(backing, 'nosharepages')
+    if len(backing):
+        insert_after(root, 'currentMemory', backing)
+
+
+def set_disk(root, disk_path, spec):
+    devices = root.find('devices')
+    disk = devices.find('disk')
+    disk.find('driver').set('cache', spec['disk_cache'])
+    disk.find('source').set('file', disk_path)
+    target, controller = DISK_BUSES[spec['disk_bus']]
+    disk.find('target').set('dev', target)
+    disk.find('target').set('bus', spec['disk_bus'])
+    if controller:
+        insert_after(devices, 'disk', ET.Element(
+            'controller', type=spec['disk_bus'], model=controller
+        ))
+
+
+def build(name, mem_size, disk_path, mac_addr, spec,
+          template_path=TEMPLATE_PATH):
+    # spec: hypervisor features, see schema.DOMAIN_DEFAULTS
+    root = load_template(template_path)
+    root.find('name').text = name
+    set_memory(root, mem_size, spec)
+    set_cpus(root, spec)
+    set_disk(root, disk_path, spec)
+    root.find('devices/interface/mac').set('address', mac_addr)
+    root.find('devices/channel/source').set('path', AGENT_SOCKET_FMT % name)
+    return ET.tostring(root)
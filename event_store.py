@@ -0,0 +1,150 @@
+import json
+import os
+import re
+
+import numpy as np
+
+import blobstore
+import stacks
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('cpu', '<u2'),
+    ('pid', '<u4'),
+    ('preempt', '<u4'),
+    ('stack', '<u4'),
+])
+
+HEADER_RE = re.compile(
+    r'^\s*(?P<comm>.*?)\s+(?P<pid>\d+)(?:/\d+)?\s+\[(?P<cpu>\d+)\]\s+'
+    r'(?P<timestamp>\d+\.\d+):\s+(?P<event>\S+):(?:\s+(?P<fields>.*))?$'
+)
+
+
+def parse_perf_script(text):
+    # Yields (timestamp, cpu, pid, event, fields, frames) per sample of
+    # `perf script` output; frames are symbol names, leaf first.
+    header = None
+    frames = []
+    for line in text.splitlines():
+        if not line.strip():
+            if header:
+                yield header + (frames,)
+            header = None
+            frames = []
+            continue
+        if header is None:
+            match = HEADER_RE.match(line)
+            if match:
+                header = (
+                    float(match.group('timestamp')),
+                    int(match.group('cpu')),
+                    int(match.group('pid')),
+                    match.group('event'),
+                    match.group('fields') or '',
+                )
+            continue
+        parts = line.split(None, 2)
+        frames.append(len(parts) > 1 and parts[1] or parts[0])
+    if header:
+        yield header + (frames,)
+
+
+class EventStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.data_path = os.path.join(path, 'events.bin')
+        self.index_path = os.path.join(path, 'index.json')
+        self.frames = stacks.InternTable()
+        # (event name, tuple of frame ids)
+        self.stacks = stacks.InternTable()
+        self.index = {}
+        self._mmap = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                saved = json.load(f)
+            self.frames = stacks.InternTable(saved['frames'])
+            self.stacks = stacks.InternTable(
+                (event, tuple(frames)) for event, frames in saved['stacks']
+            )
+            self.index = {
+                run_id: tuple(span) for run_id, span in saved['index'].items()
+            }
+
+    def __contains__(self, run_id):
+        return str(run_id) in self.index
+
+    def add(self, run_id, perf_output):
+        rows = []
+        for (timestamp, cpu, pid, event, fields,
+             frames) in parse_perf_script(perf_output):
+            stack = self.stacks.intern((
+                event,
+                tuple(self.frames.intern(frame) for frame in frames),
+            ))
+            rows.append((
+                timestamp, cpu, pid,
+                stacks.preempt_count((event, fields)),
+                stack,
+            ))
+        records = np.array(rows, dtype=RECORD_DTYPE)
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with open(self.data_path, 'ab') as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell() // RECORD_DTYPE.itemsize
+            f.write(records.tostring())
+        self.index[str(run_id)] = (offset, len(records))
+        self._mmap = None
+
+    def save(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'frames': self.frames.values,
+                'stacks': self.stacks.values,
+                'index': self.index,
+            }, f)
+        os.rename(tmp_path, self.index_path)
+
+    def ingest_missing(self, coll, run_ids, blobs):
+        missing = [run_id for run_id in run_ids if run_id not in self]
+        if not missing:
+            return
+        for rec in coll.find(
+            {'_id': {'$in': missing}},
+            {'perf.output': 1},
+        ):
+            self.add(rec['_id'],
+                     blobstore.resolve(rec['perf']['output'], blobs))
+        self.save()
+
+    def records(self, run_id):
+        offset, count = self.index[str(run_id)]
+        if not count:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        if self._mmap is None:
+            self._mmap = np.memmap(self.data_path, dtype=RECORD_DTYPE,
+                                   mode='r')
+        return self._mmap[offset:offset + count]
+
+    def event(self, stack_id, preempt):
+        # Same shape as perf_parse events: (name, fields, frames)
+        event, frames = self.stacks[stack_id]
+        return (
+            event,
+            'preempt_count=%d' % preempt,
+            [(self.frames[frame],) for frame in frames],
+        )
+
+    def stack_counts(self, run_id):
+        records = self.records(run_id)
+        keys = (
+            records['stack'].astype(np.uint64) << np.uint64(32) |
+            records['preempt'].astype(np.uint64)
+        )
+        keys, counts = np.unique(keys, return_counts=True)
+        for key, count in zip(keys, counts):
+            yield self.event(int(key >> np.uint64(32)),
+                             int(key & np.uint64(0xffffffff))), int(count)
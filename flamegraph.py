@@ -0,0 +1,181 @@
+import cgi
+import os
+import zlib
+
+WIDTH = 1200
+FRAME_HEIGHT = 16
+FONT_SIZE = 11
+MIN_WIDTH = 0.1
+CHAR_WIDTH = FONT_SIZE * 0.59
+
+# Frame names from the JSON index are unicode.
+utf8 = lambda s: isinstance(s, unicode) and s.encode('utf-8') or s
+
+
+def fold(histogram, counts):
+    # Collapse stacks to root-first frame paths; perf lists the leaf first.
+    folded = {}
+    for stack_id in counts.nonzero()[0]:
+        path = tuple(reversed(histogram.frame_names(stack_id)))
+        folded[path] = folded.get(path, 0) + int(counts[stack_id])
+    return folded
+
+
+def write_folded(path, folded):
+    with open(path, 'w') as f:
+        for frames, count in sorted(folded.items()):
+            f.write(utf8('%s %d\n' % (';'.join(frames), count)))
+
+
+def build_tree(folded, base=None):
+    root = {'name': 'all', 'count': 0, 'base': 0, 'children': {}}
+    for source, key in ((folded, 'count'), (base or {}, 'base')):
+        for frames, count in source.items():
+            node = root
+            node[key] += count
+            for frame in frames:
+                node = node['children'].setdefault(
+                    frame,
+                    {'name': frame, 'count': 0, 'base': 0, 'children': {}},
+                )
+                node[key] += count
+    return root
+
+
+def depth(node):
+    return 1 + max([0] + [depth(c) for c in node['children'].values()])
+
+
+def shares(node, root):
+    # Fractions of each side's samples, so a run that just collected more
+    # samples doesn't show up as a regression everywhere.
+    return (
+        node['count'] / float(max(root['count'], 1)),
+        node['base'] / float(max(root['base'], 1)),
+    )
+
+
+def frame_color(node, root, differential):
+    if not differential:
+        h = zlib.crc32(utf8(node['name'])) & 0xffffffff
+        return 'rgb(%d,%d,%d)' % (
+            205 + h % 50, (h >> 8) % 230, (h >> 16) % 55
+        )
+    share, base_share = shares(node, root)
+    delta = share - base_share
+    scale = max(share, base_share) or 1
+    fade = int(255 - 200 * min(abs(delta) / scale, 1.0))
+    if delta > 0:
+        return 'rgb(255,%d,%d)' % (fade, fade)
+    return 'rgb(%d,%d,255)' % (fade, fade)
+
+
+def frame_title(node, root, differential):
+    share, base_share = shares(node, root)
+    title = '%s (%d samples, %.2f%%' % (
+        node['name'], node['count'], 100 * share
+    )
+    if differential:
+        title += ', %+.2f%% vs base' % (100 * (share - base_share))
+    return title + ')'
+
+
+def render_frames(out, node, x, level, height, scale, root, differential):
+    width = node['count'] * scale
+    if width < MIN_WIDTH:
+        return
+    y = height - (level + 1) * FRAME_HEIGHT
+    label = node['name'][:int(width / CHAR_WIDTH) - 2]
+    if len(label) < 3:
+        label = ''
+    elif len(label) < len(node['name']):
+        label = label[:-2] + '..'
+    out.append(
+        '<g><title>%s</title>'
+        '<rect x="%.1f" y="%d" width="%.1f" height="%d" fill="%s" '
+        'rx="2" ry="2"/>'
+        '<text x="%.1f" y="%d">%s</text></g>' % (
+            cgi.escape(frame_title(node, root, differential)),
+            x, y, width, FRAME_HEIGHT - 1,
+            frame_color(node, root, differential),
+            x + 3, y + FRAME_HEIGHT - 4, cgi.escape(label),
+        )
+    )
+    for child in sorted(node['children'].values(), key=lambda c: c['name']):
+        render_frames(out, child, x, level + 1, height, scale, root,
+                      differential)
+        x += child['count'] * scale
+
+
+def render_svg(path, title, folded, base=None):
+    tree = build_tree(folded, base)
+    differential = base is not None
+    height = (depth(tree) + 2) * FRAME_HEIGHT
+    scale = float(WIDTH) / max(tree['count'], 1)
+    out = [
+        '<?xml version="1.0" standalone="no"?>',
+        '<svg version="1.1" width="%d" height="%d" '
+        'xmlns="http://www.w3.org/2000/svg" font-family="Verdana" '
+        'font-size="%d">' % (WIDTH, height, FONT_SIZE),
+        '<text x="%d" y="%d" text-anchor="middle" font-size="%d">%s</text>' % (
+            WIDTH / 2, FRAME_HEIGHT, FONT_SIZE + 3, cgi.escape(title)
+        ),
+    ]
+    render_frames(out, tree, 0.0, 0, height, scale, tree, differential)
+    out.append('</svg>')
+    with open(path, 'w') as f:
+        f.write(utf8('\n'.join(out)))
+
+
+def write_index(path, graphs):
+    with open(path, 'w') as f:
+        f.write('<html><head><title>Halt flame graphs</title></head><body>\n')
+        for title, name in graphs:
+            f.write('<h3>%s</h3><object data="%s" type="image/svg+xml">'
+                    '</object>\n' % (cgi.escape(title), name))
+        f.write('</body></html>\n')
+
+
+def export_flamegraphs(out_dir, histogram, pairs):
+    # pairs: (workload, base bucket, compared bucket), e.g. with_fix and
+    # without_fix of the same workload.
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    counts = histogram.counts()
+    graphs = []
+    for workload, base_name, name in pairs:
+        for mem_size in histogram.mem_sizes:
+            mem = histogram.mem_sizes.ids[mem_size]
+            folded = {}
+            for bucket in (base_name, name):
+                test = histogram.tests.ids[bucket]
+                folded[bucket] = fold(histogram, counts[:, test, mem])
+                if not folded[bucket]:
+                    continue
+                graph = '%s-%d' % (bucket, mem_size)
+                write_folded(
+                    os.path.join(out_dir, graph + '.folded'), folded[bucket]
+                )
+                render_svg(
+                    os.path.join(out_dir, graph + '.svg'),
+                    '%s, %d MB' % (bucket, mem_size),
+                    folded[bucket],
+                )
+                graphs.append(('%s, %d MB' % (bucket, mem_size),
+                               graph + '.svg'))
+
+            if not folded[base_name] or not folded[name]:
+                continue
+            graph = '%s-diff-%d' % (workload, mem_size)
+            title = ('%s, %d MB: %s vs %s '
+                     '(red: larger share of halts in %s)') % (
+                workload, mem_size, name, base_name, name
+            )
+            render_svg(
+                os.path.join(out_dir, graph + '.svg'),
+                title,
+                folded[name],
+                folded[base_name],
+            )
+            graphs.append((title, graph + '.svg'))
+    write_index(os.path.join(out_dir, 'index.html'), graphs)
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+# None, 'page' (read templates through once so the first boot of a run
+# doesn't start from a cold page cache) or 'tmpfs' (back overlays with a
+# copy of the template under CACHE_DIR).
+CACHE_MODE = 'page'
+CACHE_DIR = '/dev/shm/apf-images'
+# Allocate the L1/L2 tables of each overlay up front. qemu-img releases
+# before 2.x refuse preallocation together with a backing file.
+PREALLOCATE = False
+CHUNK_SIZE = 2 ** 20
+
+_prepared = {}
+_prepared_lock = threading.Lock()
+
+
+class ImageError(Exception):
+    pass
+
+
+def read_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def checksum(path):
+    digest = hashlib.sha1()
+    for chunk in read_chunks(path):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify(path):
+    # The digest of each template is kept next to it in <template>.sha1 and
+    # only recomputed when the file's size or mtime change; a template that
+    # changed under the same digest file has been modified in place, which
+    # corrupts every overlay built on it.
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime]
+    sidecar = path + '.sha1'
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            known = json.load(f)
+        if known['stamp'] == stamp:
+            return known['sha1']
+        digest = checksum(path)
+        if digest != known['sha1']:
+            raise ImageError('%s changed: sha1 %s, expected %s' % (
+                path, digest, known['sha1']
+            ))
+    else:
+        digest = checksum(path)
+    with open(sidecar, 'w') as f:
+        json.dump({'sha1': digest, 'stamp': stamp}, f)
+    return digest
+
+
+def copy_to_cache(path, digest):
+    # Copies are named by digest, so a copy that exists is complete and
+    # current.
+    cached = os.path.join(CACHE_DIR, digest + '.qcow2')
+    if os.path.exists(cached):
+        return cached
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR)
+    with os.fdopen(fd, 'wb') as dst, open(path, 'rb') as src:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, cached)
+    return cached
+
+
+def prepare(template_path):
+    # Once per template per process: returns (backing path, sha1).
+    path = os.path.abspath(template_path)
+    with _prepared_lock:
+        if path not in _prepared:
+            digest = verify(path)
+            backing = path
+            if CACHE_MODE == 'tmpfs':
+                backing = copy_to_cache(path, digest)
+            elif CACHE_MODE == 'page':
+                for _ in read_chunks(path):
+                    pass
+            _prepared[path] = (backing, digest)
+        return _prepared[path]
+
+
+def create_overlay(template_path, output_path):
+    backing, digest = prepare(template_path)
+    command = ['qemu-img', 'create', '-f', 'qcow2', '-b', backing]
+    if PREALLOCATE:
+        command += ['-o', 'preallocation=metadata']
+    with open(os.devnull, 'w') as f:
+        subprocess.check_call(
+            command + [output_path],
+            stdout=f,
+            stderr=f,
+        )
+    os.chmod(output_path, 0o777)
+    return digest
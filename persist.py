@@ -0,0 +1,147 @@
+#!/usr/bin/python
+import Queue
+import cPickle as pickle
+import logging
+import os
+import threading
+import time
+
+import bson
+import pymongo
+
+SPOOL_DIR = '/home/dkuznets/projects/school/apf-spool'
+BATCH_SIZE = 16
+# How long to wait for more records before flushing a partial batch.
+BATCH_WAIT = 1.0
+RETRY_INTERVAL = 30
+# How long flush() waits before giving up and leaving records spooled.
+FLUSH_TIMEOUT = 120
+# Insert failures that retrying can't fix; the record's spool file is
+# renamed to .bad instead.
+PERMANENT_ERRORS = (
+    pymongo.errors.InvalidDocument,
+    pymongo.errors.InvalidStringData,
+    pymongo.errors.InvalidName,
+)
+
+
+class WriteBehind(object):
+    # Records are spooled to disk, then inserted into Mongo in batches by a
+    # background thread; the spool file is removed once the insert is done.
+    # Spool files left by a previous process are queued again on startup.
+    def __init__(self, spool_dir=SPOOL_DIR):
+        self._spool_dir = spool_dir
+        self._queue = Queue.Queue()
+        self._db = pymongo.MongoClient()['apf']
+        if not os.path.isdir(spool_dir):
+            os.makedirs(spool_dir)
+        for name in sorted(os.listdir(spool_dir)):
+            if name.endswith('.pickle'):
+                self._queue.put(os.path.join(spool_dir, name))
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, collection, record):
+        # A fixed _id makes re-inserting a batch after a partial failure
+        # harmless.
+        record.setdefault('_id', bson.ObjectId())
+        name = '%017.6f-%s.pickle' % (time.time(), record['_id'])
+        path = os.path.join(self._spool_dir, name)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((collection, record), f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+        self._queue.put(path)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + BATCH_WAIT
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(
+                    self._queue.get(timeout=max(deadline - time.time(), 0))
+                )
+            except Queue.Empty:
+                break
+        return batch
+
+    def _insert(self, batch):
+        by_collection = {}
+        for path in batch:
+            if not os.path.exists(path):
+                # Set aside by an earlier attempt at this batch.
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    collection, record = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                logging.exception('unreadable spool file %s', path)
+                os.rename(path, path + '.bad')
+                continue
+            by_collection.setdefault(collection, []).append((path, record))
+        for collection, items in by_collection.items():
+            coll = self._db[collection]
+            try:
+                coll.insert([record for _, record in items],
+                            continue_on_error=True)
+                continue
+            except pymongo.errors.DuplicateKeyError:
+                # Only the last error of the batch is reported; whatever is
+                # not in the collection now failed for some other reason.
+                present = set(doc['_id'] for doc in coll.find(
+                    {'_id': {'$in': [record['_id'] for _, record in items]}},
+                    {'_id': 1},
+                ))
+                items = [(path, record) for path, record in items
+                         if record['_id'] not in present]
+            except PERMANENT_ERRORS:
+                logging.exception('batch rejected, inserting one by one')
+            for path, record in items:
+                try:
+                    coll.insert(record)
+                except pymongo.errors.DuplicateKeyError:
+                    pass
+                except PERMANENT_ERRORS:
+                    logging.exception('cannot insert %s', path)
+                    os.rename(path, path + '.bad')
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            while True:
+                try:
+                    self._insert(batch)
+                    break
+                except Exception:
+                    logging.exception('insert failed, %d records spooled',
+                                      len(batch))
+                    time.sleep(RETRY_INTERVAL)
+            for path in batch:
+                if os.path.exists(path):
+                    os.unlink(path)
+                self._queue.task_done()
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        # Returns False if records are still spooled after `timeout`
+        # seconds (Mongo unreachable); they are inserted by a later run.
+        # Queue.join() can't be interrupted by ^C in python 2.
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if time.time() > deadline:
+                logging.warning('%d records left spooled in %s',
+                                self._queue.unfinished_tasks, self._spool_dir)
+                return False
+            time.sleep(0.1)
+        return True
+
+
+_writer = None
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        _writer = WriteBehind(SPOOL_DIR)
+    return _writer
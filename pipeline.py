@@ -0,0 +1,239 @@
+#!/usr/bin/python
+import argparse
+import cPickle as pickle
+import collections
+import json
+import os
+import sys
+
+import columnar
+import compare
+import cube
+import event_store
+import flamegraph
+import json_results
+import results
+import schema
+import spreadsheet
+import stacks
+import stats
+import timeline
+
+CACHE_DIR = '.pipeline'
+
+
+def cache_path(name):
+    return os.path.join(CACHE_DIR, '%s.pickle' % name)
+
+
+def load_cache(name):
+    with open(cache_path(name), 'rb') as f:
+        return pickle.load(f)
+
+
+def dump_cache(name, obj):
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    tmp_path = cache_path(name) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, cache_path(name))
+
+
+def source_fingerprint():
+    coll = results.get_collection()
+    latest = list(
+        coll.find(results.query, {'_id': 1}).sort('_id', -1).limit(1)
+    )
+    return {
+        'count': coll.find(results.query).count(),
+        'latest': latest and str(latest[0]['_id']) or None,
+        'mem_sizes': list(results.MEM_SIZES),
+    }
+
+
+def extract():
+    buckets = results.do_lookup(results.get_collection())
+    results.print_buckets(buckets)
+    with open(os.path.join(CACHE_DIR, 'extract.fingerprint'), 'w') as f:
+        json.dump(source_fingerprint(), f)
+    return buckets
+
+
+def extract_is_fresh():
+    try:
+        with open(os.path.join(CACHE_DIR, 'extract.fingerprint')) as f:
+            return json.load(f) == source_fingerprint()
+    except IOError:
+        return False
+
+
+def transform(buckets):
+    return {
+        'tables': results.results_to_tables(buckets),
+        'json': json_results.transformed_results(buckets),
+    }
+
+
+def export_ods(transformed):
+    results.export_ods('results.ods', transformed['tables'])
+
+
+def events(buckets):
+    return results.export_events(buckets)
+
+
+def export_events(histogram):
+    results.export_events_ods('events.ods', histogram)
+
+
+def export_flamegraphs(histogram):
+    results.export_flamegraphs('flamegraphs', histogram)
+
+
+def export_timeline(buckets):
+    results.export_timeline('timeline.json', buckets)
+
+
+def export_compare(buckets):
+    json_results.export_comparison(
+        'compare.json', json_results.comparison(buckets)
+    )
+
+
+def export_json(transformed):
+    json_results.export_all(transformed['json'])
+
+
+# Stages without output files keep their result in the pickle cache. A
+# stage is also rerun when the source of one of its modules, or of this
+# file, changed after its outputs were written.
+STAGES = collections.OrderedDict([
+    ('extract', {
+        'deps': [],
+        'func': extract,
+        'outputs': [],
+        'modules': [results, schema],
+        'fresh': extract_is_fresh,
+    }),
+    ('transform', {
+        'deps': ['extract'],
+        'func': transform,
+        'outputs': [],
+        'modules': [results, json_results, schema, stats],
+    }),
+    ('export-ods', {
+        'deps': ['transform'],
+        'func': export_ods,
+        'outputs': ['results.ods'],
+        'modules': [results, spreadsheet],
+    }),
+    ('events', {
+        'deps': ['extract'],
+        'func': events,
+        'outputs': [],
+        'modules': [results, event_store, stacks],
+    }),
+    ('export-events', {
+        'deps': ['events'],
+        'func': export_events,
+        'outputs': ['events.ods'],
+        'modules': [results, spreadsheet, stacks],
+    }),
+    ('export-flamegraphs', {
+        'deps': ['events'],
+        'func': export_flamegraphs,
+        'outputs': ['flamegraphs/index.html'],
+        'modules': [results, flamegraph, stacks],
+    }),
+    ('export-timeline', {
+        'deps': ['extract'],
+        'func': export_timeline,
+        'outputs': ['timeline.json'],
+        'modules': [results, timeline],
+    }),
+    ('export-compare', {
+        'deps': ['extract'],
+        'func': export_compare,
+        'outputs': ['compare.json', 'compare.ods'],
+        'modules': [results, json_results, compare, spreadsheet, stats],
+    }),
+    ('export-json', {
+        'deps': ['transform'],
+        'func': export_json,
+        'outputs': ['test.json', 'test.columnar.json', 'test.cube.json'],
+        'modules': [json_results, columnar, cube, stats],
+    }),
+])
+
+
+def stage_outputs(name):
+    return STAGES[name]['outputs'] or [cache_path(name)]
+
+
+def source_path(module):
+    # The .py next to a loaded .pyc.
+    return os.path.splitext(module.__file__)[0] + '.py'
+
+
+def source_mtimes(name):
+    modules = STAGES[name]['modules'] + [sys.modules[__name__]]
+    return [os.path.getmtime(source_path(module)) for module in modules]
+
+
+def is_fresh(name):
+    stage = STAGES[name]
+    outputs = stage_outputs(name)
+    if not all(os.path.exists(output) for output in outputs):
+        return False
+    if 'fresh' in stage and not stage['fresh']():
+        return False
+    written = min(os.path.getmtime(output) for output in outputs)
+    inputs = source_mtimes(name) + [
+        os.path.getmtime(output)
+        for dep in stage['deps']
+        for output in stage_outputs(dep)
+    ]
+    return all(mtime <= written for mtime in inputs)
+
+
+def build(name, force, built):
+    if name in built:
+        return
+    stage = STAGES[name]
+    for dep in stage['deps']:
+        build(dep, force, built)
+    built.add(name)
+
+    if name not in force and is_fresh(name):
+        print 'stage %s is up to date' % name
+        return
+    print 'running stage %s' % name
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    result = stage['func'](*[load_cache(dep) for dep in stage['deps']])
+    if not stage['outputs']:
+        dump_cache(name, result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        default=['export-ods', 'export-events',
+                                 'export-flamegraphs', 'export-timeline',
+                                 'export-compare', 'export-json'],
+                        help='one of: %s' % ', '.join(STAGES))
+    parser.add_argument('--force', action='store_true',
+                        help='rerun the requested stages even if up to date')
+    args = parser.parse_args(argv)
+    for name in args.stages:
+        if name not in STAGES:
+            parser.error('unknown stage %s' % name)
+
+    built = set()
+    for name in args.stages:
+        build(name, args.force and set(args.stages) or set(), built)
+
+
+if __name__ == '__main__':
+    main()
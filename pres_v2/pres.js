@@ -102,16 +102,81 @@ var events_snippet = {
 }
 
 
+// Columnar DB loader
+var typed_arrays = {
+    'uint8': Uint8Array,
+    'uint16': Uint16Array,
+    'int32': Int32Array,
+    'float64': Float64Array,
+};
+
+function typed_column(dtype, values) {
+    if (dtype == 'string' || dtype == 'bool') {
+        return values;
+    }
+    if (dtype == 'float64') {
+        values = values.map(function (x) { return x === null ? NaN : x; });
+    }
+    return new typed_arrays[dtype](values);
+}
+
+function set_path(obj, path, value) {
+    var keys = path.split('.');
+    keys.slice(0, -1).forEach(function (key) {
+        if (!(key in obj)) {
+            obj[key] = {};
+        }
+        obj = obj[key];
+    });
+    obj[keys[keys.length - 1]] = value;
+}
+
+function load_columnar(data) {
+    var columns = Object.keys(data.columns).map(function (path) {
+        return {
+            path: path,
+            values: typed_column(data.dtypes[path], data.columns[path]),
+            dictionary: data.dictionaries[path],
+        };
+    });
+
+    var records = [];
+    for (var i = 0; i < data.length; ++i) {
+        var rec = {};
+        columns.forEach(function (col) {
+            var value = col.values[i];
+            if (col.dictionary) {
+                value = col.dictionary[value];
+            } else if (value !== value || value === null) {
+                value = null;
+            }
+            set_path(rec, col.path, value);
+        });
+        records.push(rec);
+    }
+    return records;
+}
+
+
 // Load DB data
-var db = null;
+var cube = null;
+var db_request = null;
+
+function with_db(callback) {
+    if (db_request === null) {
+        db_request = $.getJSON('db.columnar.json').then(load_columnar);
+    }
+    db_request.done(callback);
+}
+
 function start() {
     $.getJSON(
-        'db.json',
+        'db.cube.json',
         function (data) {
-            db = data;
+            cube = index_cube(data);
             build_tab(
                 $("#tabs-apache"), 
-                all_test('apache_test', db),
+                'apache_test',
                 [
                     rand_files_snippet,
                     host_swap_snippet,
@@ -120,7 +185,7 @@ function start() {
             );
             build_tab(
                 $("#tabs-node"),
-                all_test('node_test', db),
+                'node_test',
                 [
                     rand_files_snippet,
                     host_swap_snippet,
@@ -129,7 +194,7 @@ function start() {
             );
             build_tab(
                 $("#tabs-memcached"),
-                all_test('memcached_test_mini', db),
+                'memcached_test_mini',
                 [
                     host_swap_snippet,
                     events_snippet,
@@ -137,7 +202,7 @@ function start() {
             );
             build_tab(
                 $("#tabs-postgresql"),
-                all_test('pgbench_test', db),
+                'pgbench_test',
                 [
                     host_swap_snippet,
                     events_snippet,
@@ -148,6 +213,34 @@ function start() {
     );
 };
 
+function cube_key(test, type, mem) {
+    return [test, type, mem].join('/');
+}
+
+function index_cube(data) {
+    var cells = {};
+    data.cells.forEach(function (cell) {
+        cells[cube_key(cell.test, cell.type, cell.memory)] = cell;
+    });
+    return {cells: data.cells, index: cells};
+}
+
+function cube_stat(test, type, mem, metric, stat) {
+    var cell = cube.index[cube_key(test, type, mem)];
+    if (!cell || !cell.metrics[metric].count) {
+        return null;
+    }
+    return Number(cell.metrics[metric][stat].toFixed(4));
+}
+
+function cube_mem_sizes(test) {
+    return cube.cells.filter(function (cell) {
+        return cell.test == test;
+    }).map(function (cell) {
+        return cell.memory;
+    }).unique().sort(function (a, b) { return a - b; });
+}
+
 function res_to_row (res) {
     return [
         res.type,
@@ -170,41 +263,6 @@ function res_to_row (res) {
     ];
 }
 
-function sum (a, b) {
-    return a + b;
-}
-
-function average(results) {
-    if (results.length == 0) {
-        console.trace();
-    }
-    return Number((results.reduce(sum) / results.length).toFixed(4));
-}
-
-function average_duration(results) {
-    return average(results.map(function (x) { return x.test.results.duration; }));
-}
-
-function average_events(results) {
-    return average(results.map(function (x) { return x.events.total; }));
-}
-
-function all_type(t, results) {
-    return results.filter(function (x) { return x.type == t; }); 
-}
-
-function all_opt (results) {
-    return all_type('optimum', results);
-}
-
-function all_with (results) {
-    return all_type('with_fix', results);
-}
-
-function all_without (results) {
-    return all_type('without_fix', results);
-}
-
 function all_mem (mem, results) {
     return results.filter(function (x) {
         return eff_mem(x) == mem;
@@ -212,45 +270,46 @@ function all_mem (mem, results) {
 }
 
 
-function summary_row(results) {
-    var opt = all_opt(results);
-    var with_ = all_with(results);
-    var without = all_without(results);
-
+function summary_row(test, mem) {
     return [
-        eff_mem(results[0]),
-        average_duration(opt),
+        mem,
+        cube_stat(test, 'optimum', mem, 'duration', 'mean'),
         0,
-        average_duration(with_),
-        average_events(with_),
-        average_duration(without),
-        average_events(without),
+        cube_stat(test, 'with_fix', mem, 'duration', 'mean'),
+        cube_stat(test, 'with_fix', mem, 'events', 'mean'),
+        cube_stat(test, 'without_fix', mem, 'duration', 'mean'),
+        cube_stat(test, 'without_fix', mem, 'events', 'mean'),
     ];
 }
 
 function eff_mem(res) {
-    return res.type == 'optimum' ? res.memory.total : res.memory.cgroup_limit;
+    return res.memory.effective;
 }
 
-function build_tab(root, results, per_mem_elements) {
-    var mem_sizes = results.map(
-        eff_mem
-    ).unique().sort(function (a, b) { return a - b; });
+function lazy_accordion(elem, build) {
+    var built = false;
+    $(elem).accordion({
+        collapsible: true,
+        active: false,
+        beforeActivate: function (event, ui) {
+            if (!built && ui.newPanel.length) {
+                built = true;
+                build(ui.newPanel);
+            }
+        },
+    });
+}
+
+function build_tab(root, test, per_mem_elements) {
+    var mem_sizes = cube_mem_sizes(test);
 
-    var summary_table = $(document.createElement('table'));
     root.append(
         $(document.createElement('table')).prop('id', 'summary')
     );
 
     root.find("#summary").dataTable({
         "data": mem_sizes.map(function (mem) {
-            return summary_row(
-                results.filter(
-                    function (x) {
-                        return eff_mem(x) == mem;
-                    }
-                )
-            );
+            return summary_row(test, mem);
         }),
         "columns": summary_columns,
         "paging": false,
@@ -286,41 +345,43 @@ function build_tab(root, results, per_mem_elements) {
                 $(document.createElement('h3')).html('All results')
             )
             .append(
-                $(document.createElement('table')).prop('id', 'all-results')
+                $(document.createElement('div'))
+                    .append(
+                        $(document.createElement('table'))
+                            .prop('id', 'all-results')
+                    )
             )
     )
 
-
-
-    root.find("#all-results").dataTable({
-        "data": results.map(res_to_row),
-        "columns": [
-            simple_col('Type'),
-            simple_col('Total memory'),
-            simple_col('Alloc. memory'),
-            simple_col('Success'),
-            simple_col('Duration'),
-            simple_col('Guest swap reads'),
-            simple_col('Guest swap writes'),
-            simple_col('Guest rootfs reads'),
-            simple_col('Guest rootfs writes'),
-            simple_col('Guest rand-files reads'),
-            simple_col('Guest rand-files writes'),
-            simple_col('Host swap reads'),
-            simple_col('Host swap writes'),
-            simple_col('Halt events'),
-            simple_col('Halt events (outside IRQ)'),
-
-            simple_col('ID'),
-        ],
-        "paging": false,
-        "ordering": true,
-        "info": false,
-        "searching": false,
-    });
-    root.find("#all-results-div").accordion({
-        collapsible: true,
-        active: false,
+    lazy_accordion(root.find("#all-results-div"), function (panel) {
+        with_db(function (db) {
+            panel.find("#all-results").dataTable({
+                "data": all_test(test, db).map(res_to_row),
+                "columns": [
+                    simple_col('Type'),
+                    simple_col('Total memory'),
+                    simple_col('Alloc. memory'),
+                    simple_col('Success'),
+                    simple_col('Duration'),
+                    simple_col('Guest swap reads'),
+                    simple_col('Guest swap writes'),
+                    simple_col('Guest rootfs reads'),
+                    simple_col('Guest rootfs writes'),
+                    simple_col('Guest rand-files reads'),
+                    simple_col('Guest rand-files writes'),
+                    simple_col('Host swap reads'),
+                    simple_col('Host swap writes'),
+                    simple_col('Halt events'),
+                    simple_col('Halt events (outside IRQ)'),
+
+                    simple_col('ID'),
+                ],
+                "paging": false,
+                "ordering": true,
+                "info": false,
+                "searching": false,
+            });
+        });
     });
 
     // Summary - times
@@ -336,12 +397,11 @@ function build_tab(root, results, per_mem_elements) {
     var data = google.visualization.arrayToDataTable([
         ['Memory size', 'Optimum', 'With fix', 'Without fix'],
     ].concat(mem_sizes.map(function (mem) {
-        ress = all_mem(mem, results);
         return [
             mem.toString() + ' MB',
-            average_duration(all_opt(ress)),
-            average_duration(all_with(ress)),
-            average_duration(all_without(ress)),
+            cube_stat(test, 'optimum', mem, 'duration', 'mean'),
+            cube_stat(test, 'with_fix', mem, 'duration', 'mean'),
+            cube_stat(test, 'without_fix', mem, 'duration', 'mean'),
         ]
     })));
     new google.visualization.ColumnChart(root.find("#g-times").get(0)).draw(data, options);
@@ -359,11 +419,10 @@ function build_tab(root, results, per_mem_elements) {
     var data = google.visualization.arrayToDataTable([
         ['Memory size', 'With fix', 'Without fix'],
     ].concat(mem_sizes.map(function (mem) {
-        ress= all_mem(mem, results);
         return [
             mem.toString() + ' MB',
-            average_events(all_with(ress)),
-            average_events(all_without(ress)),
+            cube_stat(test, 'with_fix', mem, 'events', 'mean'),
+            cube_stat(test, 'without_fix', mem, 'events', 'mean'),
         ]
     })));
     new google.visualization.ColumnChart(root.find("#g-events").get(0)).draw(data, options);
@@ -392,38 +451,38 @@ function build_tab(root, results, per_mem_elements) {
             function (i) { trendlines[i] = {} }
         );
 
-        mem_sizes.forEach(function (mem) {
-            var new_graph = document.createElement('span');
-            var options = {
-                title: mem.toString() + ' MB',
-                hAxis: { title: 'Time taken in seconds'},
-                vAxis: { title: 'Operations'},
-                width: 800,
-                height: 800,
-                trendlines: trendlines,
-                chartArea: { width: '60%' },
-            };
-
-            var data = google.visualization.arrayToDataTable(
-                [
-                    legend,
-                ].concat(
-                    all_mem(
-                        mem,
-                        results
-                    ).map(
-                        row_func
-                    )
-                )
-            );
-            new google.visualization.ScatterChart(new_graph).draw(data, options);
-            $(new_graph).css('float', 'left');
-
-            $(per_mem_graphs).append(new_graph);
-        });
-        $(per_mem).accordion({
-            collapsible: true,
-            active: false,
+        lazy_accordion(per_mem, function () {
+            with_db(function (db) {
+                var results = all_test(test, db);
+                mem_sizes.forEach(function (mem) {
+                    var new_graph = document.createElement('span');
+                    var options = {
+                        title: mem.toString() + ' MB',
+                        hAxis: { title: 'Time taken in seconds'},
+                        vAxis: { title: 'Operations'},
+                        width: 800,
+                        height: 800,
+                        trendlines: trendlines,
+                        chartArea: { width: '60%' },
+                    };
+
+                    var data = google.visualization.arrayToDataTable(
+                        [
+                            legend,
+                        ].concat(
+                            all_mem(
+                                mem,
+                                results
+                            ).map(
+                                row_func
+                            )
+                        )
+                    );
+                    $(per_mem_graphs).append(new_graph);
+                    new google.visualization.ScatterChart(new_graph).draw(data, options);
+                    $(new_graph).css('float', 'left');
+                });
+            });
         });
     });
 }
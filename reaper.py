@@ -0,0 +1,43 @@
+#!/usr/bin/python
+import Queue
+import logging
+import shutil
+import threading
+import time
+
+
+class Reaper(object):
+    # Deletes run directories (overlay images, perf output) in the
+    # background so VM teardown doesn't wait for the filesystem.
+    def __init__(self):
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def reap(self, path):
+        self._queue.put(path)
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                shutil.rmtree(path)
+            except OSError:
+                logging.exception('failed to remove %s', path)
+            self._queue.task_done()
+
+    def flush(self):
+        # Queue.join() can't be interrupted by ^C in python 2.
+        while self._queue.unfinished_tasks:
+            time.sleep(0.1)
+
+
+_reaper = None
+
+
+def get_reaper():
+    global _reaper
+    if _reaper is None:
+        _reaper = Reaper()
+    return _reaper
@@ -1,14 +1,30 @@
 #!/usr/bin/python
-import os
-
+import numpy as np
 import pymongo
-import ezodf
 
-import perf_parse
+import blobstore
+import event_store
+import flamegraph
+import schema
+import spreadsheet
+import stacks
+import stats
+import timeline
+
+
+def get_collection():
+    return pymongo.MongoClient()['apf']['results']
+
 
-con = pymongo.MongoClient()
-db = con['apf']
-coll = db['results']
+EVENT_STORE_PATH = '.events'
+_event_store = None
+
+
+def get_event_store():
+    global _event_store
+    if _event_store is None:
+        _event_store = event_store.EventStore(EVENT_STORE_PATH)
+    return _event_store
 
 
 MEM_SIZES = (256, 277, 298, 320, 341, 362, 384, 512, 1024, 2048)
@@ -16,6 +32,8 @@ MEM_SIZES = (256, 277, 298, 320, 384, 512, 1024, 2048)
 MEM_SIZES = (256, 298, 341, 384, 512, 1024, 2048)
 # MEM_SIZES = (256, )
 
+ROWS = 20
+
 key_mem_size = lambda x: x['machine_spec']['mem_size']
 key_cgroup_limit = lambda x: x['cgroup_limit']
 key_cgroup_limit_none_fix = lambda x: key_cgroup_limit(x) or 2048
@@ -28,98 +46,97 @@ pred_psql = lambda x: x['test']['name'] == 'pgbench_test'
 pred_never = lambda x: False
 
 
-# memcached results
-memcached_optimum = {m: [] for m in MEM_SIZES}
-memcached_with_fix = {m: [] for m in MEM_SIZES}
-memcached_without_fix = {m: [] for m in MEM_SIZES}
+BUCKETS = [
+    'memcached_optimum',
+    'memcached_with_fix',
+    'memcached_without_fix',
+    'apache_optimum',
+    'apache_with_fix',
+    'apache_without_fix',
+    'node_optimum',
+    'node_with_fix',
+    'node_without_fix',
+    'postgresql_optimum',
+    'postgresql_with_fix',
+    'postgresql_without_fix',
+]
 
-# apache results
-apache_optimum = {m: [] for m in MEM_SIZES}
-apache_with_fix = {m: [] for m in MEM_SIZES}
-apache_without_fix = {m: [] for m in MEM_SIZES}
 
-# node
-node_optimum = {m: [] for m in MEM_SIZES}
-node_with_fix = {m: [] for m in MEM_SIZES}
-node_without_fix = {m: [] for m in MEM_SIZES}
+def empty_buckets():
+    return {name: {m: [] for m in MEM_SIZES} for name in BUCKETS}
 
-# postgresql
-postgresql_optimum = {m: [] for m in MEM_SIZES}
-postgresql_with_fix = {m: [] for m in MEM_SIZES}
-postgresql_without_fix = {m: [] for m in MEM_SIZES}
 
-_PREFIXED = lambda img: os.path.join(
-    '/home/dkuznets/projects/school/apf-images',
-    img,
-)
-TEMPLATE_CLEAN = _PREFIXED('fedora20-clean.qcow2.template')
-TEMPLATE_FIX = _PREFIXED('fedora20-withfix7.qcow2.template')
-TEMPLATE_NOFIX = _PREFIXED('fedora20-withoutfix7.qcow2.template')
+def bucket_variants(buckets, name):
+    # The bucket and its copies for non-default hypervisor features,
+    # named '<bucket>|<schema.axes_label>'.
+    return [name] + sorted(
+        k for k in buckets if k.startswith(name + '|')
+    )
 
 memcached_lookup = {
-    TEMPLATE_CLEAN: (
-        memcached_optimum,
+    'clean': (
+        'memcached_optimum',
         key_mem_size,
         pred_memcached,
     ),
-    TEMPLATE_FIX: (
-        memcached_with_fix,
+    'fix': (
+        'memcached_with_fix',
         key_cgroup_limit,
         pred_memcached,
     ),
-    TEMPLATE_NOFIX: (
-        memcached_without_fix,
+    'nofix': (
+        'memcached_without_fix',
         key_cgroup_limit,
         pred_memcached,
     ),
 }
 apache_lookup = {
-    TEMPLATE_CLEAN: (
-        apache_optimum,
+    'clean': (
+        'apache_optimum',
         key_mem_size,
         pred_apache,
     ),
-    TEMPLATE_FIX: (
-        apache_with_fix,
+    'fix': (
+        'apache_with_fix',
         key_cgroup_limit_none_fix,
         pred_apache,
     ),
-    TEMPLATE_NOFIX: (
-        apache_without_fix,
+    'nofix': (
+        'apache_without_fix',
         key_cgroup_limit_none_fix,
         pred_apache,
     ),
 }
 node_lookup = {
-    TEMPLATE_CLEAN: (
-        node_optimum,
+    'clean': (
+        'node_optimum',
         key_mem_size,
         pred_node,
     ),
-    TEMPLATE_FIX: (
-        node_with_fix,
+    'fix': (
+        'node_with_fix',
         key_cgroup_limit_none_fix,
         pred_node,
     ),
-    TEMPLATE_NOFIX: (
-        node_without_fix,
+    'nofix': (
+        'node_without_fix',
         key_cgroup_limit_none_fix,
         pred_node,
     ),
 }
 postgresql_lookup = {
-    TEMPLATE_CLEAN: (
-        postgresql_optimum,
+    'clean': (
+        'postgresql_optimum',
         key_mem_size,
         pred_psql,
     ),
-    TEMPLATE_FIX: (
-        postgresql_with_fix,
+    'fix': (
+        'postgresql_with_fix',
         key_cgroup_limit_none_fix,
         pred_psql,
     ),
-    TEMPLATE_NOFIX: (
-        postgresql_without_fix,
+    'nofix': (
+        'postgresql_without_fix',
         key_cgroup_limit_none_fix,
         pred_psql,
     ),
@@ -155,8 +172,14 @@ query = {
 }
 
 
-def do_lookup():
-    for rec in con['apf']['results'].find(query):
+def do_lookup(coll):
+    buckets = empty_buckets()
+    perf_runs = []
+    # Perf output is only read for runs the event store has not seen yet.
+    for rec in coll.find(query, {'perf.output': 0, 'ssh_history': 0}):
+        blobstore.resolve(rec, blobstore.get_store())
+        if rec['perf']:
+            perf_runs.append(rec['_id'])
         lookup = {
             'memcached_test_mini': memcached_lookup,
             'apache_test': apache_lookup,
@@ -164,13 +187,20 @@ def do_lookup():
             'pgbench_test': postgresql_lookup,
         }[rec['test']['name']]
 
-        res_dict, key, pred = lookup.get(
-            rec['machine_spec']['template_path'],
-            ({}, None, pred_never)
+        bucket, key, pred = lookup.get(
+            schema.variant(rec),
+            (None, None, pred_never)
         )
         if pred(rec) and key(rec) in MEM_SIZES:
-            res_dict[key(rec)].append(rec)
-do_lookup()
+            axes = schema.axes_label(rec['machine_spec'])
+            if axes:
+                # Not comparable with the default runs: kept apart, and
+                # left out of the reports built on BUCKETS.
+                bucket = '%s|%s' % (bucket, axes)
+                buckets.setdefault(bucket, {m: [] for m in MEM_SIZES})
+            buckets[bucket][key(rec)].append(rec)
+    get_event_store().ingest_missing(coll, perf_runs, blobstore.get_store())
+    return buckets
 
 
 def print_res_stats(results):
@@ -178,38 +208,11 @@ def print_res_stats(results):
         if len(v):
             print k, len(v)
 
-print 'memcached_optimum'
-print_res_stats(memcached_optimum)
-print 'memcached_with_fix'
-print_res_stats(memcached_with_fix)
-print 'memcached_without_fix'
-print_res_stats(memcached_without_fix)
 
-print 'apache_optimum'
-print_res_stats(apache_optimum)
-print 'apache_with_fix'
-print_res_stats(apache_with_fix)
-print 'apache_without_fix'
-print_res_stats(apache_without_fix)
-
-print 'node_optimum'
-print_res_stats(node_optimum)
-print 'node_with_fix'
-print_res_stats(node_with_fix)
-print 'node_without_fix'
-print_res_stats(node_without_fix)
-
-print 'postgresql_optimum'
-print_res_stats(postgresql_optimum)
-print 'postgresql_with_fix'
-print_res_stats(postgresql_with_fix)
-print 'postgresql_without_fix'
-print_res_stats(postgresql_without_fix)
-
-
-def set_row(sheet, row, values):
-    for (index, value) in enumerate(values):
-        sheet[(row, index)] = ezodf.Cell(value)
+def print_buckets(buckets):
+    for name in BUCKETS:
+        print name
+        print_res_stats(buckets[name])
 
 
 LEGEND_MEMCACHED = [
@@ -254,11 +257,33 @@ def block_stat(cont):
         int(e) for e in cont.strip('\x00').strip().split()
     ]
 
-HOST_SWAP_PATH = '/sys/block/dm-1/stat'
-GUEST_SWAP_PATH = '/sys/block/dm-1/stat'
+block_stat_path = lambda dev: '/sys/block/%s/stat' % dev
+
+
+def device_path(res, side, role):
+    dev = (res.get('devices') or schema.LEGACY_DEVICES)[side][role]
+    return dev and block_stat_path(dev)
+
+
+def guest_data_path(res):
+    # The first data device whose counters were collected.
+    if type(res['files']['guest']['pre']) == list:
+        fix_files(res['files']['guest'])
+    devices = (res.get('devices') or schema.LEGACY_DEVICES)['guest']['data']
+    for dev in devices:
+        if block_stat_path(dev) in res['files']['guest']['pre']:
+            return block_stat_path(dev)
+    return None
+
+
+def perf_event_counts(res):
+    records = get_event_store().records(res['_id'])
+    return len(records), int((records['preempt'] < 256).sum())
 
 
 def fix_files(res):
+    if type(res['pre']) != list:
+        return
     res['pre'] = {
         e['path']: e['contents']
         for e in res['pre']
@@ -269,39 +294,60 @@ def fix_files(res):
     }
 
 
-def memcached_res_to_row(res):
+def host_probe_deltas(res, path):
+    probe = res['files']['host']['probe']
+    for stat in probe['stats']:
+        if stat['path'] == path:
+            return stat['deltas']
+    raise KeyError(path)
+
+
+def host_delta(res, path):
+    # Counter deltas of a host file over the whole run.
+    if 'probe' in res['files']['host']:
+        return host_probe_deltas(res, path)[-1]
+    # Runs recorded before HostProbe store the raw file contents.
     fix_files(res['files']['host'])
+    pre = block_stat(res['files']['host']['pre'][path])
+    post = block_stat(res['files']['host']['post'][path])
+    return [b - a for (a, b) in zip(pre, post)]
 
-    host_swap_pre = block_stat(res['files']['host']['pre'][HOST_SWAP_PATH])
-    host_swap_post = block_stat(res['files']['host']['post'][HOST_SWAP_PATH])
-    host_swap_delta = [
-        post - pre for (pre, post) in zip(host_swap_pre, host_swap_post)
-    ]
 
-    try:
-        guest_swap_pre = block_stat(
-            res['files']['guest']['pre'][GUEST_SWAP_PATH]
-        )
-        guest_swap_post = block_stat(
-            res['files']['guest']['post'][GUEST_SWAP_PATH]
-        )
-        guest_swap_delta = [
-            post - pre for (pre, post) in zip(guest_swap_pre, guest_swap_post)
+def guest_delta(res, path):
+    if type(res['files']['guest']['pre']) == list:
+        fix_files(res['files']['guest'])
+    pre = block_stat(res['files']['guest']['pre'][path])
+    post = block_stat(res['files']['guest']['post'][path])
+    return [b - a for (a, b) in zip(pre, post)]
+
+
+def host_series(res, path):
+    # (times, counters) of a host file sampled during the run.
+    host = res['files']['host']
+    if 'probe' in host:
+        times = host['probe']['times']
+        counters = host_probe_deltas(res, path)
+    else:
+        samples = host.get('samples') or []
+        times = [sample['time'] for sample in samples]
+        counters = [
+            block_stat(sample['contents'][path]) for sample in samples
         ]
+    return np.array(times), np.array(counters)
+
+
+def memcached_res_to_row(res):
+    host_swap_delta = host_delta(res, device_path(res, 'host', 'swap'))
+
+    try:
+        guest_swap_delta = guest_delta(res, device_path(res, 'guest', 'swap'))
     except KeyError:
         guest_swap_delta = [None] * 8
 
     events = 'N/A'
     events_noirq = 'N/A'
     if res['perf']:
-        all_events = list(perf_parse.parse_perf_output(res['perf']['output']))
-        events = len(all_events)
-        events_noirq = len(
-            [
-                e for e in all_events
-                if int(e[1].split('=')[-1].strip()) < 256
-            ]
-        )
+        events, events_noirq = perf_event_counts(res)
 
     return [
         str(res['_id']),
@@ -321,36 +367,11 @@ def memcached_res_to_row(res):
     ]
 
 
-def memcached_results_to_sheet(name, results):
-    print name
-    sheet = ezodf.Sheet(name, size=(1000, 100))
-    set_row(sheet, 0, LEGEND_MEMCACHED)
-    for row, res in enumerate(map(memcached_res_to_row, results[-20:])):
-        set_row(sheet, row + 1, res)
-    return sheet
-
-
 def apache_res_to_row(res):
-    fix_files(res['files']['host'])
-    if type(res['files']['guest']['pre']) == list:
-        fix_files(res['files']['guest'])
-
-    host_swap_pre = block_stat(res['files']['host']['pre'][HOST_SWAP_PATH])
-    host_swap_post = block_stat(res['files']['host']['post'][HOST_SWAP_PATH])
-    host_swap_delta = [
-        post - pre for (pre, post) in zip(host_swap_pre, host_swap_post)
-    ]
+    host_swap_delta = host_delta(res, device_path(res, 'host', 'swap'))
 
     try:
-        guest_swap_pre = block_stat(
-            res['files']['guest']['pre'][GUEST_SWAP_PATH]
-        )
-        guest_swap_post = block_stat(
-            res['files']['guest']['post'][GUEST_SWAP_PATH]
-        )
-        guest_swap_delta = [
-            post - pre for (pre, post) in zip(guest_swap_pre, guest_swap_post)
-        ]
+        guest_swap_delta = guest_delta(res, device_path(res, 'guest', 'swap'))
     except KeyError:
         guest_swap_delta = [None] * 8
 
@@ -370,14 +391,7 @@ def apache_res_to_row(res):
     events = 'N/A'
     events_noirq = 'N/A'
     if res['perf']:
-        all_events = list(perf_parse.parse_perf_output(res['perf']['output']))
-        events = len(all_events)
-        events_noirq = len(
-            [
-                e for e in all_events
-                if int(e[1].split('=')[-1].strip()) < 256
-            ]
-        )
+        events, events_noirq = perf_event_counts(res)
     return [
         str(res['_id']),
         res['test']['name'],
@@ -401,26 +415,10 @@ def apache_res_to_row(res):
 
 
 def postgresql_res_to_row(res):
-    fix_files(res['files']['host'])
-    if type(res['files']['guest']['pre']) == list:
-        fix_files(res['files']['guest'])
-
-    host_swap_pre = block_stat(res['files']['host']['pre'][HOST_SWAP_PATH])
-    host_swap_post = block_stat(res['files']['host']['post'][HOST_SWAP_PATH])
-    host_swap_delta = [
-        post - pre for (pre, post) in zip(host_swap_pre, host_swap_post)
-    ]
+    host_swap_delta = host_delta(res, device_path(res, 'host', 'swap'))
 
     try:
-        guest_swap_pre = block_stat(
-            res['files']['guest']['pre'][GUEST_SWAP_PATH]
-        )
-        guest_swap_post = block_stat(
-            res['files']['guest']['post'][GUEST_SWAP_PATH]
-        )
-        guest_swap_delta = [
-            post - pre for (pre, post) in zip(guest_swap_pre, guest_swap_post)
-        ]
+        guest_swap_delta = guest_delta(res, device_path(res, 'guest', 'swap'))
     except KeyError:
         guest_swap_delta = [None] * 8
 
@@ -432,14 +430,7 @@ def postgresql_res_to_row(res):
     events = 'N/A'
     events_noirq = 'N/A'
     if res['perf']:
-        all_events = list(perf_parse.parse_perf_output(res['perf']['output']))
-        events = len(all_events)
-        events_noirq = len(
-            [
-                e for e in all_events
-                if int(e[1].split('=')[-1].strip()) < 256
-            ]
-        )
+        events, events_noirq = perf_event_counts(res)
 
     return [
         str(res['_id']),
@@ -460,341 +451,136 @@ def postgresql_res_to_row(res):
     ]
 
 
-def apache_results_to_sheet(name, results):
-    print name
-    sheet = ezodf.Sheet(name, size=(1000, 100))
-    set_row(sheet, 0, LEGEND_MEMCACHED)
-    for row, res in enumerate(map(apache_res_to_row, results[-20:])):
-        set_row(sheet, row + 1, res)
-    return sheet
-
-
-def postgresql_results_to_sheet(name, results):
-    print name
-    sheet = ezodf.Sheet(name, size=(1000, 100))
-    set_row(sheet, 0, LEGEND_POSTGRESQL)
-    for row, res in enumerate(map(postgresql_res_to_row, results[-20:])):
-        set_row(sheet, row + 1, res)
-    return sheet
-
-
-def sheet_col_average(sheet, col_name):
-    legend = [sheet[(0, i)].value for i in range(30)]
-    legend = [l for l in legend if l]
-    col = legend.index(col_name)
-    succ_col = legend.index('Test success')
-    cells = [
-        sheet[(i, col)].value
-        for i in range(1, sheet.nrows())
-        if sheet[(i, succ_col)].value == 1
-    ]
-    return sum(cells) / len(cells)
-
-
-def fill_summary(ods, summary):
-    layout = [
-        ['Apache'],
-        [
-            'Memory pressure',
-            'Optimum average time',
-            'Fixed average time',
-            'Fixed average halt events',
-            'Unfixed averag time',
-            'Unfixed average halt events',
-        ]
-    ]
-
-    for mem_size in MEM_SIZES:
-        layout.append(
-            [
-                mem_size,
-                sheet_col_average(
-                    ods.sheets['apache_optimum-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['apache_with_fix-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['apache_with_fix-%d' % mem_size],
-                    'Halt events'
-                ),
-                sheet_col_average(
-                    ods.sheets['apache_without_fix-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['apache_without_fix-%d' % mem_size],
-                    'Halt events'
-                ),
-            ]
-        )
-    layout.extend([
-        ['memcached'],
-        [
-            'Memory pressure',
-            'Optimum average time',
-            'Fixed average time',
-            'Fixed average halt events',
-            'Unfixed averag time',
-            'Unfixed average halt events',
-        ],
-    ])
-    for mem_size in MEM_SIZES:
-        layout.append(
-            [
-                mem_size,
-                sheet_col_average(
-                    ods.sheets['memcached_optimum-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['memcached_with_fix-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['memcached_with_fix-%d' % mem_size],
-                    'Halt events'
-                ),
-                sheet_col_average(
-                    ods.sheets['memcached_without_fix-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['memcached_without_fix-%d' % mem_size],
-                    'Halt events'
-                ),
-            ]
-        )
+RESULT_SHEETS = [
+    ('memcached_optimum', LEGEND_MEMCACHED, memcached_res_to_row),
+    ('memcached_with_fix', LEGEND_MEMCACHED, memcached_res_to_row),
+    ('memcached_without_fix', LEGEND_MEMCACHED, memcached_res_to_row),
+    ('apache_optimum', LEGEND_APACHE, apache_res_to_row),
+    ('apache_with_fix', LEGEND_APACHE, apache_res_to_row),
+    ('apache_without_fix', LEGEND_APACHE, apache_res_to_row),
+    ('node_optimum', LEGEND_APACHE, apache_res_to_row),
+    ('node_with_fix', LEGEND_APACHE, apache_res_to_row),
+    ('node_without_fix', LEGEND_APACHE, apache_res_to_row),
+    ('postgresql_optimum', LEGEND_POSTGRESQL, postgresql_res_to_row),
+    ('postgresql_with_fix', LEGEND_POSTGRESQL, postgresql_res_to_row),
+    ('postgresql_without_fix', LEGEND_POSTGRESQL, postgresql_res_to_row),
+]
+SUMMARY_WORKLOADS = [
+    ('Apache', 'apache'),
+    ('memcached', 'memcached'),
+    ('node', 'node'),
+    ('postgresql', 'postgresql'),
+]
+SUMMARY_LEGEND = [
+    'Memory pressure',
+    'Optimum average time',
+    'Optimum time 95% CI',
+    'Fixed average time',
+    'Fixed time 95% CI',
+    'Fixed average halt events',
+    'Unfixed averag time',
+    'Unfixed time 95% CI',
+    'Unfixed average halt events',
+]
 
-    layout.extend([
-        ['node'],
-        [
-            'Memory pressure',
-            'Optimum average time',
-            'Fixed average time',
-            'Fixed average halt events',
-            'Unfixed averag time',
-            'Unfixed average halt events',
-        ],
-    ])
-    for mem_size in MEM_SIZES:
-        layout.append(
-            [
-                mem_size,
-                sheet_col_average(
-                    ods.sheets['node_optimum-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['node_with_fix-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['node_with_fix-%d' % mem_size],
-                    'Halt events'
-                ),
-                sheet_col_average(
-                    ods.sheets['node_without_fix-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['node_without_fix-%d' % mem_size],
-                    'Halt events'
-                ),
-            ]
-        )
 
-    layout.extend([
-        ['postgresql'],
-        [
-            'Memory pressure',
-            'Optimum average time',
-            'Fixed average time',
-            'Fixed average halt events',
-            'Unfixed averag time',
-            'Unfixed average halt events',
-        ],
-    ])
-    for mem_size in MEM_SIZES:
-        layout.append(
-            [
-                mem_size,
-                sheet_col_average(
-                    ods.sheets['postgresql_optimum-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['postgresql_with_fix-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['postgresql_with_fix-%d' % mem_size],
-                    'Halt events'
-                ),
-                sheet_col_average(
-                    ods.sheets['postgresql_without_fix-%d' % mem_size],
-                    'Duration'
-                ),
-                sheet_col_average(
-                    ods.sheets['postgresql_without_fix-%d' % mem_size],
-                    'Halt events'
-                ),
+def results_to_tables(buckets):
+    tables = []
+    for name, legend, res_to_row in RESULT_SHEETS:
+        for mem_size, results in sorted(buckets[name].items()):
+            if not len(results):
+                continue
+            tables.append((
+                '%s-%d' % (name, mem_size),
+                legend,
+                map(res_to_row, results[-ROWS:]),
+            ))
+    return tables
+
+
+def tables_to_stats(tables):
+    cells = {}
+    for name, legend, rows in tables:
+        succ_col = legend.index('Test success')
+        for col_name in ('Duration', 'Halt events'):
+            col = legend.index(col_name)
+            cells[(name, col_name)] = [
+                row[col] for row in rows if row[succ_col] == 1
             ]
-        )
-
-    for i, row in enumerate(layout):
-        set_row(summary, i, row)
+    return stats.aggregate_cells(cells)
 
 
-def export_ods(path):
-    ods = ezodf.newdoc(doctype='ods', filename=path)
-    summary = ezodf.Sheet('summary', size=(100, 100))
-    ods.sheets += summary
-    for mem_size, results in sorted(memcached_optimum.items()):
-        if not len(results):
-            continue
-        ods.sheets += memcached_results_to_sheet(
-            'memcached_optimum-%d' % mem_size,
-            results
-        )
-    for mem_size, results in sorted(memcached_with_fix.items()):
-        if not len(results):
-            continue
-        if mem_size is None:
-            mem_size = 'unrestrained'
-        ods.sheets += memcached_results_to_sheet(
-            'memcached_with_fix-%s' % str(mem_size),
-            results
-        )
-    for mem_size, results in sorted(memcached_without_fix.items()):
-        if not len(results):
-            continue
-        if mem_size is None:
-            mem_size = 'unrestrained'
-        ods.sheets += memcached_results_to_sheet(
-            'memcached_without_fix-%s' % str(mem_size),
-            results
-        )
-
-    for mem_size, results in sorted(apache_optimum.items()):
-        if not len(results):
-            continue
-        ods.sheets += apache_results_to_sheet(
-            'apache_optimum-%d' % mem_size,
-            results
-        )
-    for mem_size, results in sorted(apache_with_fix.items()):
-        if not len(results):
-            continue
-        ods.sheets += apache_results_to_sheet(
-            'apache_with_fix-%d' % mem_size,
-            results
-        )
-    for mem_size, results in sorted(apache_without_fix.items()):
-        if mem_size is None:
-            mem_size = 2048
-        if not len(results):
-            continue
-        ods.sheets += apache_results_to_sheet(
-            'apache_without_fix-%d' % mem_size,
-            results
-        )
-
-    for mem_size, results in sorted(node_optimum.items()):
-        if not len(results):
-            continue
-        ods.sheets += apache_results_to_sheet(
-            'node_optimum-%d' % mem_size,
-            results
-        )
-    for mem_size, results in sorted(node_with_fix.items()):
-        if not len(results):
-            continue
-        ods.sheets += apache_results_to_sheet(
-            'node_with_fix-%d' % mem_size,
-            results
-        )
-    for mem_size, results in sorted(node_without_fix.items()):
-        if mem_size is None:
-            mem_size = 2048
-        if not len(results):
-            continue
-        ods.sheets += apache_results_to_sheet(
-            'node_without_fix-%d' % mem_size,
-            results
-        )
+def summary_rows(table_stats):
+    def stat(name, col_name, key):
+        return table_stats.get((name, col_name), {}).get(key)
 
-    for mem_size, results in sorted(postgresql_optimum.items()):
-        if not len(results):
-            continue
-        ods.sheets += postgresql_results_to_sheet(
-            'postgresql_optimum-%d' % mem_size,
-            results
-        )
-    for mem_size, results in sorted(postgresql_with_fix.items()):
-        if not len(results):
-            continue
-        ods.sheets += postgresql_results_to_sheet(
-            'postgresql_with_fix-%d' % mem_size,
-            results
-        )
-    for mem_size, results in sorted(postgresql_without_fix.items()):
-        if not len(results):
-            continue
-        ods.sheets += postgresql_results_to_sheet(
-            'postgresql_without_fix-%d' % mem_size,
-            results
-        )
+    def ci(name):
+        low = stat(name, 'Duration', 'ci_low')
+        high = stat(name, 'Duration', 'ci_high')
+        if low is None:
+            return 'N/A'
+        return '%.3f - %.3f' % (low, high)
 
-    fill_summary(ods, summary)
-    ods.save()
-export_ods('results.ods')
+    layout = []
+    for title, workload in SUMMARY_WORKLOADS:
+        layout.extend([
+            [title, 'averages over the last %d runs of each cell' % ROWS],
+            SUMMARY_LEGEND,
+        ])
+        for mem_size in MEM_SIZES:
+            optimum = '%s_optimum-%d' % (workload, mem_size)
+            with_fix = '%s_with_fix-%d' % (workload, mem_size)
+            without_fix = '%s_without_fix-%d' % (workload, mem_size)
+            layout.append(
+                [
+                    mem_size,
+                    stat(optimum, 'Duration', 'mean'),
+                    ci(optimum),
+                    stat(with_fix, 'Duration', 'mean'),
+                    ci(with_fix),
+                    stat(with_fix, 'Halt events', 'mean'),
+                    stat(without_fix, 'Duration', 'mean'),
+                    ci(without_fix),
+                    stat(without_fix, 'Halt events', 'mean'),
+                ]
+            )
+
+    return layout
+
+
+def export_ods(path, tables):
+    spreadsheet.save(
+        path,
+        [('summary', summary_rows(tables_to_stats(tables)))] + [
+            (name, [legend] + rows) for name, legend, rows in tables
+        ],
+    )
+
+
+EVENT_BUCKETS = [
+    'apache_with_fix',
+    'apache_without_fix',
+    'memcached_with_fix',
+    'memcached_without_fix',
+    'node_with_fix',
+    'node_without_fix',
+    'postgresql_with_fix',
+    'postgresql_without_fix',
+]
 
 
-def simplify_event(event):
-    return (event[0], event[1], tuple((frame[0],) for frame in event[2]))
+def export_events(buckets):
+    histogram = stacks.StackHistogram(EVENT_BUCKETS, MEM_SIZES)
+    store = get_event_store()
+    for name in EVENT_BUCKETS:
+        for mem_pressure, tests in buckets[name].items():
+            for test in tests[-10:]:
+                for event, count in store.stack_counts(test['_id']):
+                    histogram.add(event, name, mem_pressure, count)
+    return histogram
 
 
-def export_events():
-    events_histogram = {}
-    for name, collection in (
-        ('apache_with_fix', apache_with_fix),
-        ('apache_without_fix', apache_without_fix),
-        ('memcached_with_fix', memcached_with_fix),
-        ('memcached_without_fix', memcached_without_fix),
-        ('node_with_fix', node_with_fix),
-        ('node_without_fix', node_without_fix),
-        ('postgresql_with_fix', postgresql_with_fix),
-        ('postgresql_without_fix', postgresql_without_fix),
-    ):
-        for mem_pressure, tests in collection.items():
-            for test in tests[-10:]:
-                for event in perf_parse.parse_perf_output(
-                    test['perf']['output']
-                ):
-                    event = simplify_event(event)
-                    if event not in events_histogram:
-                        events_histogram[event] = {
-                            'by_test': {},
-                            'by_mem_pressure': {}
-                        }
-                    events_histogram[event]['by_test'][name] = (
-                        events_histogram[event]['by_test'].get(name, 0) + 1
-                    )
-                    events_histogram[event]['by_mem_pressure'][
-                        mem_pressure
-                    ] = (
-                        events_histogram[event]['by_mem_pressure'].get(
-                            mem_pressure, 0
-                        ) + 1
-                    )
-    return events_histogram
-
-
-def export_events_ods(path):
-    hist = export_events()
+def export_events_ods(path, histogram):
     COLUMNS = [
         'Event',
         'Preempt count',
@@ -802,55 +588,77 @@ def export_events_ods(path):
         'Total',
         'with_fix',
         'without_fix',
-        'apache_with_fix',
-        'apache_without_fix',
-        'memcached_with_fix',
-        'memcached_without_fix',
-        'node_with_fix',
-        'node_without_fix',
-        'postgresql_with_fix',
-        'postgresql_without_fix',
-    ] + [
+    ] + EVENT_BUCKETS + [
         '%d MB' % mem_pressure
         for mem_pressure in MEM_SIZES
     ]
+    with_fix = [
+        i for i, name in enumerate(EVENT_BUCKETS)
+        if name.endswith('_with_fix')
+    ]
+    without_fix = [
+        i for i, name in enumerate(EVENT_BUCKETS)
+        if name.endswith('_without_fix')
+    ]
+
+    counts = histogram.counts()
+    by_test = counts.sum(axis=2)
+    columns = [
+        by_test.sum(axis=1),
+        by_test[:, with_fix].sum(axis=1),
+        by_test[:, without_fix].sum(axis=1),
+    ] + list(by_test.T) + list(counts.sum(axis=1).T)
+
     rows = []
-    for event, stats in hist.items():
+    for stack_id in histogram.top(counts):
+        event, preempt, _ = histogram.stacks[stack_id]
         rows.append([
-            event[0],
-            int(event[1].split('=')[-1]),
-            ','.join([frame[0] for frame in event[2]]),
-            sum(stats['by_test'].values()),
-            (
-                stats['by_test'].get('apache_with_fix', 0) +
-                stats['by_test'].get('memcached_with_fix', 0) +
-                stats['by_test'].get('node_with_fix', 0) +
-                stats['by_test'].get('postgresql_with_fix', 0)
-            ),
-            (
-                stats['by_test'].get('apache_without_fix', 0) +
-                stats['by_test'].get('memcached_without_fix', 0) +
-                stats['by_test'].get('node_without_fix', 0) +
-                stats['by_test'].get('postgresql_without_fix', 0)
-            ),
-            stats['by_test'].get('apache_with_fix', 0),
-            stats['by_test'].get('apache_without_fix', 0),
-            stats['by_test'].get('memcached_with_fix', 0),
-            stats['by_test'].get('memcached_without_fix', 0),
-            stats['by_test'].get('node_with_fix', 0),
-            stats['by_test'].get('node_without_fix', 0),
-            stats['by_test'].get('postgresql_with_fix', 0),
-            stats['by_test'].get('postgresql_without_fix', 0),
-        ] + [
-            stats['by_mem_pressure'].get(mem_pressure, 0)
-            for mem_pressure in MEM_SIZES
-        ])
-    sorted_rows = sorted(rows, key=lambda x: int(x[3]), reverse=True)
-    sheet = ezodf.Sheet('events', size=(4000, 100))
-    set_row(sheet, 0, COLUMNS)
-    for i, row in enumerate(sorted_rows):
-        set_row(sheet, i + 1, row)
-    ods = ezodf.newdoc(doctype='ods', filename=path)
-    ods.sheets += sheet
-    ods.save()
-export_events_ods('events.ods')
+            event,
+            preempt,
+            ','.join(histogram.frame_names(stack_id)),
+        ] + [int(column[stack_id]) for column in columns])
+    spreadsheet.save(path, [('events', [COLUMNS] + rows)])
+
+
+def run_timeline(res):
+    timing = res.get('timing') or {}
+    if not res['perf'] or not timing.get('end'):
+        return None
+    if timing['end'] - timing['start'] < timeline.BIN_WIDTH:
+        return None
+    times, swap = host_series(res, device_path(res, 'host', 'swap'))
+    if not len(times):
+        return None
+    return timeline.align_run(
+        res,
+        get_event_store().records(res['_id']),
+        times,
+        swap[:, 0],
+        swap[:, 4],
+    )
+
+
+def export_timeline(path, buckets):
+    cells = {}
+    for name in EVENT_BUCKETS:
+        for mem_pressure, tests in buckets[name].items():
+            runs = [run for run in map(run_timeline, tests[-ROWS:]) if run]
+            cells[(name, mem_pressure)] = runs
+    timeline.export_timeline(path, cells)
+
+
+FLAMEGRAPH_PAIRS = [
+    ('apache', 'apache_with_fix', 'apache_without_fix'),
+    ('memcached', 'memcached_with_fix', 'memcached_without_fix'),
+    ('node', 'node_with_fix', 'node_without_fix'),
+    ('postgresql', 'postgresql_with_fix', 'postgresql_without_fix'),
+]
+
+
+def export_flamegraphs(out_dir, histogram):
+    flamegraph.export_flamegraphs(out_dir, histogram, FLAMEGRAPH_PAIRS)
+
+
+if __name__ == '__main__':
+    import pipeline
+    pipeline.main(['export-ods', 'export-events'])
@@ -0,0 +1,185 @@
+#!/usr/bin/python
+import os
+
+import pymongo
+
+# 0: no version field, runs identified by machine_spec.template_path only
+# 1: 'template' and 'variant' labels
+# 2: host files stored as HostProbe deltas in files.host.probe
+# 3: block devices by role in 'devices'
+SCHEMA_VERSION = 3
+
+VARIANTS = {
+    'fedora20-clean.qcow2.template': 'clean',
+    'fedora20-withfix7.qcow2.template': 'fix',
+    'fedora20-withoutfix7.qcow2.template': 'nofix',
+}
+
+# Hypervisor features a machine_spec can vary; runs that leave them at
+# these values are comparable with runs recorded before they existed.
+DOMAIN_DEFAULTS = {
+    'hugepages': False,
+    # None leaves the host KSM setting alone.
+    'ksm': None,
+    # 'virtio' (virtio-blk) or 'scsi' (virtio-scsi)
+    'disk_bus': 'virtio',
+    'disk_cache': 'none',
+    # [(seconds after the test starts, balloon target in MiB), ...]
+    'balloon': None,
+    'vcpus': 1,
+    # Host CPUs for the vCPUs: a cpuset string shared by all of them, or a
+    # list with one host CPU per vCPU.
+    'cpuset': None,
+    'emulator_cpuset': None,
+    # Host NUMA nodes guest memory is allocated from.
+    'numa_nodeset': None,
+    'numa_mode': 'strict',
+}
+
+# Device layout of runs recorded before the runner discovered devices.
+LEGACY_DEVICES = {
+    'host': {'root': None, 'swap': 'dm-1', 'data': []},
+    # dm-3 first: when both were collected, exports have always used dm-3
+    # (the python 2 set order the old intersection happened to pop).
+    'guest': {'root': 'dm-0', 'swap': 'dm-1', 'data': ['dm-3', 'dm-2']},
+}
+
+ASC = pymongo.ASCENDING
+
+# One compound index per branch of the results.query $or, plus the
+# fields runs are routed and resumed by.
+INDEXES = {
+    'results': [
+        [('test.name', ASC), ('test.kwargs.count', ASC),
+         ('test.kwargs.key_limit', ASC)],
+        [('test.name', ASC), ('test.kwargs.requests', ASC),
+         ('test.kwargs.concurrency', ASC), ('test.result.exitcode', ASC)],
+        [('test.name', ASC), ('test.kwargs.scale', ASC),
+         ('test.kwargs.clients', ASC), ('test.kwargs.transactions', ASC),
+         ('test.result.exitcode', ASC)],
+        [('variant', ASC), ('cgroup_limit', ASC),
+         ('machine_spec.mem_size', ASC)],
+        [('run_key', ASC)],
+        [('schema_version', ASC)],
+    ],
+    'failures': [
+        [('run_key', ASC)],
+        [('kind', ASC), ('variant', ASC)],
+    ],
+}
+
+
+def get_db():
+    return pymongo.MongoClient()['apf']
+
+
+def ensure_indexes(db):
+    for name, indexes in INDEXES.items():
+        for keys in indexes:
+            db[name].ensure_index(keys)
+
+
+template_label = lambda path: os.path.basename(path)
+variant_of = lambda path: VARIANTS.get(template_label(path))
+
+
+def variant(rec):
+    if 'variant' in rec:
+        return rec['variant']
+    return variant_of(rec['machine_spec']['template_path'])
+
+
+def domain_axes(machine_spec):
+    # The hypervisor features that differ from DOMAIN_DEFAULTS.
+    return dict(
+        (k, machine_spec[k]) for k in sorted(DOMAIN_DEFAULTS)
+        if machine_spec.get(k, DOMAIN_DEFAULTS[k]) != DOMAIN_DEFAULTS[k]
+    )
+
+
+def axes_label(machine_spec):
+    # '' at the defaults, else e.g. 'disk_bus=scsi,hugepages=True'.
+    return ','.join(
+        '%s=%s' % item for item in sorted(domain_axes(machine_spec).items())
+    )
+
+
+def labels(machine_spec):
+    return {
+        'template': template_label(machine_spec['template_path']),
+        'variant': variant_of(machine_spec['template_path']),
+    }
+
+
+def migrate_v1(coll):
+    # One multi-document update per distinct template path.
+    for path in coll.distinct('machine_spec.template_path'):
+        coll.update(
+            {
+                'machine_spec.template_path': path,
+                'schema_version': {'$exists': False},
+            },
+            {'$set': dict(
+                labels({'template_path': path}),
+                schema_version=1,
+            )},
+            multi=True,
+        )
+
+
+def migrate_v2(coll):
+    # Readers take host files in either layout; the raw contents of older
+    # runs are kept as they are.
+    coll.update(
+        {'schema_version': {'$lt': 2}},
+        {'$set': {'schema_version': 2}},
+        multi=True,
+    )
+
+
+def migrate_v3(coll):
+    # Runs that recorded files predate device discovery and used the
+    # legacy layout.
+    coll.update(
+        {
+            'schema_version': {'$lt': 3},
+            'files': {'$exists': True},
+            'devices': {'$exists': False},
+        },
+        {'$set': {'devices': LEGACY_DEVICES, 'schema_version': 3}},
+        multi=True,
+    )
+    coll.update(
+        {'schema_version': {'$lt': 3}},
+        {'$set': {'schema_version': 3}},
+        multi=True,
+    )
+
+
+MIGRATIONS = [
+    (1, migrate_v1),
+    (2, migrate_v2),
+    (3, migrate_v3),
+]
+
+
+def migrate(coll):
+    for version, func in MIGRATIONS:
+        pending = coll.find(
+            {'$or': [
+                {'schema_version': {'$lt': version}},
+                {'schema_version': {'$exists': False}},
+            ]}
+        ).count()
+        if pending:
+            print '%s: migrating %d documents to v%d' % (
+                coll.name, pending, version
+            )
+            func(coll)
+
+
+if __name__ == '__main__':
+    db = get_db()
+    ensure_indexes(db)
+    migrate(db['results'])
+    migrate(db['failures'])
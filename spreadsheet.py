@@ -0,0 +1,225 @@
+import csv
+import numbers
+import os
+import shutil
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+ODS_MIMETYPE = 'application/vnd.oasis.opendocument.spreadsheet'
+ODS_MANIFEST = '''<?xml version="1.0" encoding="UTF-8"?>
+<manifest:manifest
+ xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0"
+ manifest:version="1.2">
+ <manifest:file-entry manifest:full-path="/" manifest:version="1.2"
+  manifest:media-type="%s"/>
+ <manifest:file-entry manifest:full-path="content.xml"
+  manifest:media-type="text/xml"/>
+</manifest:manifest>
+''' % ODS_MIMETYPE
+ODS_CONTENT_HEAD = '''<?xml version="1.0" encoding="UTF-8"?>
+<office:document-content
+ xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+ xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+ xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"
+ office:version="1.2"><office:body><office:spreadsheet>'''
+ODS_CONTENT_TAIL = '</office:spreadsheet></office:body></office:document-content>'
+
+XLSX_CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels"
+ ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml"
+ ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+%s
+</Types>
+'''
+XLSX_SHEET_CONTENT_TYPE = (
+    '<Override PartName="/xl/worksheets/sheet%d.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.'
+    'spreadsheetml.worksheet+xml"/>'
+)
+XLSX_ROOT_RELS = '''<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Target="xl/workbook.xml"
+ Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>
+</Relationships>
+'''
+XLSX_WORKBOOK = '''<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+ xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>%s</sheets>
+</workbook>
+'''
+XLSX_WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+%s
+</Relationships>
+'''
+XLSX_SHEET_REL = (
+    '<Relationship Id="rId%d" Target="worksheets/sheet%d.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+    'relationships/worksheet"/>'
+)
+XLSX_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+    '2006/main"><sheetData>'
+)
+XLSX_SHEET_TAIL = '</sheetData></worksheet>'
+
+
+def is_empty(value):
+    return value is None or value != value
+
+
+def is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def number_text(value):
+    if isinstance(value, (int, long)):
+        return str(value)
+    return repr(float(value))
+
+
+def to_text(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def ods_cell(value):
+    if is_empty(value):
+        return '<table:table-cell/>'
+    if is_number(value):
+        return (
+            '<table:table-cell office:value-type="float" office:value="%s">'
+            '<text:p>%s</text:p></table:table-cell>' % (
+                number_text(value), number_text(value)
+            )
+        )
+    return (
+        '<table:table-cell office:value-type="string"><text:p>%s</text:p>'
+        '</table:table-cell>' % escape(to_text(value))
+    )
+
+
+def write_ods_table(f, name, rows):
+    width = max([1] + [len(row) for row in rows])
+    f.write('<table:table table:name=%s>' % quoteattr(to_text(name)))
+    f.write(
+        '<table:table-column table:number-columns-repeated="%d"/>' % width
+    )
+    for row in rows:
+        f.write('<table:table-row>')
+        f.write(''.join(ods_cell(value) for value in row))
+        f.write('</table:table-row>')
+    f.write('</table:table>')
+
+
+def write_ods(path, sheets):
+    with tempfile.NamedTemporaryFile() as content:
+        content.write(ODS_CONTENT_HEAD)
+        for name, rows in sheets:
+            write_ods_table(content, name, rows)
+        content.write(ODS_CONTENT_TAIL)
+        content.flush()
+
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as ods:
+            # The mimetype entry must come first and stay uncompressed.
+            ods.writestr(
+                zipfile.ZipInfo('mimetype'), ODS_MIMETYPE, zipfile.ZIP_STORED
+            )
+            ods.writestr('META-INF/manifest.xml', ODS_MANIFEST)
+            ods.write(content.name, 'content.xml')
+
+
+def xlsx_column(index):
+    name = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        name = chr(ord('A') + rem) + name
+    return name
+
+
+def xlsx_cell(ref, value):
+    if is_empty(value):
+        return ''
+    if is_number(value):
+        return '<c r="%s"><v>%s</v></c>' % (ref, number_text(value))
+    return '<c r="%s" t="inlineStr"><is><t>%s</t></is></c>' % (
+        ref, escape(to_text(value))
+    )
+
+
+def write_xlsx_sheet(f, rows):
+    f.write(XLSX_SHEET_HEAD)
+    for i, row in enumerate(rows):
+        f.write('<row r="%d">' % (i + 1))
+        f.write(''.join(
+            xlsx_cell('%s%d' % (xlsx_column(j), i + 1), value)
+            for j, value in enumerate(row)
+        ))
+        f.write('</row>')
+    f.write(XLSX_SHEET_TAIL)
+
+
+def write_xlsx(path, sheets):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        names = []
+        for name, rows in sheets:
+            names.append(name)
+            with open(os.path.join(tmpdir, str(len(names))), 'w') as f:
+                write_xlsx_sheet(f, rows)
+
+        indexes = range(1, len(names) + 1)
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as xlsx:
+            xlsx.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES % ''.join(
+                XLSX_SHEET_CONTENT_TYPE % i for i in indexes
+            ))
+            xlsx.writestr('_rels/.rels', XLSX_ROOT_RELS)
+            xlsx.writestr('xl/workbook.xml', XLSX_WORKBOOK % ''.join(
+                '<sheet name=%s sheetId="%d" r:id="rId%d"/>' % (
+                    quoteattr(to_text(name)[:31]), i, i
+                )
+                for i, name in zip(indexes, names)
+            ))
+            xlsx.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS % (
+                ''.join(XLSX_SHEET_REL % (i, i) for i in indexes)
+            ))
+            for i in indexes:
+                xlsx.write(
+                    os.path.join(tmpdir, str(i)),
+                    'xl/worksheets/sheet%d.xml' % i,
+                )
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def write_csv(path, sheets):
+    # CSV holds a single table; extra sheets go to <path>-<name>.csv.
+    base, ext = os.path.splitext(path)
+    for i, (name, rows) in enumerate(sheets):
+        sheet_path = i and '%s-%s%s' % (base, name, ext) or path
+        with open(sheet_path, 'wb') as f:
+            writer = csv.writer(f)
+            for row in rows:
+                writer.writerow([
+                    not is_empty(value) and to_text(value) or ''
+                    for value in row
+                ])
+
+
+WRITERS = {
+    '.ods': write_ods,
+    '.xlsx': write_xlsx,
+    '.csv': write_csv,
+}
+
+
+def save(path, sheets):
+    WRITERS[os.path.splitext(path)[1].lower()](path, sheets)
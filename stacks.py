@@ -0,0 +1,75 @@
+import array
+
+import numpy as np
+
+
+class InternTable(object):
+    def __init__(self, values=()):
+        self.values = []
+        self.ids = {}
+        for value in values:
+            self.intern(value)
+
+    def intern(self, value):
+        try:
+            return self.ids[value]
+        except KeyError:
+            self.ids[value] = len(self.values)
+            self.values.append(value)
+            return self.ids[value]
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+
+def preempt_count(event):
+    return int(event[1].split('=')[-1].strip())
+
+
+class StackHistogram(object):
+    def __init__(self, tests, mem_sizes):
+        self.tests = InternTable(tests)
+        self.mem_sizes = InternTable(mem_sizes)
+        self.frames = InternTable()
+        # (event name, preempt count, tuple of frame ids)
+        self.stacks = InternTable()
+        self._samples = array.array('l')
+        self._weights = array.array('l')
+
+    def intern_event(self, event):
+        return self.stacks.intern((
+            event[0],
+            preempt_count(event),
+            tuple(self.frames.intern(frame[0]) for frame in event[2]),
+        ))
+
+    def add(self, event, test, mem_size, count=1):
+        self._samples.extend((
+            self.intern_event(event),
+            self.tests.ids[test],
+            self.mem_sizes.ids[mem_size],
+        ))
+        self._weights.append(count)
+
+    def counts(self):
+        shape = (len(self.stacks), len(self.tests), len(self.mem_sizes))
+        samples = np.array(self._samples, dtype=np.int64).reshape(-1, 3)
+        flat = np.ravel_multi_index(samples.T, shape)
+        weights = np.array(self._weights, dtype=np.int64)
+        return np.bincount(
+            flat, weights=weights, minlength=np.prod(shape)
+        ).astype(np.int64).reshape(shape)
+
+    def frame_names(self, stack_id):
+        return [self.frames[f] for f in self.stacks[stack_id][2]]
+
+    def top(self, counts, n=None):
+        totals = counts.sum(axis=(1, 2))
+        order = np.argsort(-totals, kind='mergesort')
+        return order[:n]
@@ -0,0 +1,77 @@
+import numbers
+import warnings
+
+import numpy as np
+
+BOOTSTRAP_SAMPLES = 1000
+CONFIDENCE = 0.95
+
+
+def to_matrix(groups):
+    # Missing or non-numeric values ('N/A', None) are dropped and every
+    # group is left-aligned in a NaN padded row.
+    groups = [
+        [float(v) for v in values
+         if isinstance(v, numbers.Number) and not isinstance(v, bool)]
+        for values in groups
+    ]
+    counts = np.array([len(values) for values in groups], dtype=int)
+    matrix = np.full((len(groups), max([1] + list(counts))), np.nan)
+    for i, values in enumerate(groups):
+        matrix[i, :len(values)] = values
+    return matrix, counts
+
+
+def bootstrap_means(matrix, counts, samples, rng):
+    cells, width = matrix.shape
+    safe_counts = np.maximum(counts, 1)
+    idx = (
+        rng.random_sample((cells, samples, width)) *
+        safe_counts[:, None, None]
+    ).astype(int)
+    resampled = matrix[np.arange(cells)[:, None, None], idx]
+    valid = np.arange(width)[None, None, :] < counts[:, None, None]
+    return np.where(valid, resampled, 0).sum(axis=2) / safe_counts[:, None]
+
+
+def aggregate(groups, samples=BOOTSTRAP_SAMPLES, confidence=CONFIDENCE,
+              seed=0):
+    matrix, counts = to_matrix(groups)
+    empty = counts == 0
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(matrix, axis=1)
+        stddev = np.where(counts > 1, np.nanstd(matrix, axis=1, ddof=1), 0.0)
+        median = np.nanmedian(matrix, axis=1)
+        p95 = np.nanpercentile(matrix, 95, axis=1)
+
+    boot = bootstrap_means(
+        matrix, counts, samples, np.random.RandomState(seed)
+    )
+    tail = (1 - confidence) / 2 * 100
+    ci_low, ci_high = np.percentile(boot, [tail, 100 - tail], axis=1)
+
+    return {
+        'count': counts,
+        'mean': np.where(empty, np.nan, mean),
+        'stddev': np.where(empty, np.nan, stddev),
+        'median': np.where(empty, np.nan, median),
+        'p95': np.where(empty, np.nan, p95),
+        'ci_low': np.where(empty, np.nan, ci_low),
+        'ci_high': np.where(empty, np.nan, ci_high),
+    }
+
+
+def aggregate_cells(cells, **kwargs):
+    keys = list(cells)
+    columns = aggregate([cells[k] for k in keys], **kwargs)
+    result = {}
+    for i, key in enumerate(keys):
+        if not columns['count'][i]:
+            result[key] = {'count': 0}
+            continue
+        result[key] = {
+            name: float(values[i]) for name, values in columns.items()
+        }
+        result[key]['count'] = int(columns['count'][i])
+    return result
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+import unittest
+
+import numpy as np
+
+import compare
+
+X = np.array([1.0, 2, 3, 4, 5])
+Y = np.array([6.0, 7, 8, 9, 10])
+# Ties within and across the samples.
+TIED_X = np.array([1.0, 2, 2, 3, 5])
+TIED_Y = np.array([2.0, 4, 4, 6, 7, 8])
+
+
+class RankdataTest(unittest.TestCase):
+    def test_ties_share_the_average_rank(self):
+        ranks, sizes = compare.rankdata(np.array([3.0, 1, 3, 2, 3]))
+        self.assertEqual(ranks.tolist(), [4, 1, 4, 2, 4])
+        self.assertEqual(sizes.tolist(), [1, 1, 3])
+
+
+class MannWhitneyTest(unittest.TestCase):
+    def test_separated_samples(self):
+        # R: wilcox.test(1:5, 6:10, exact=FALSE) gives W = 0, p = 0.01219
+        u, p = compare.mann_whitney(X, Y)
+        self.assertEqual(u, 0)
+        self.assertAlmostEqual(p, 0.01219, places=5)
+
+    def test_symmetric(self):
+        u, p = compare.mann_whitney(Y, X)
+        self.assertEqual(u, 25)
+        self.assertAlmostEqual(p, 0.01219, places=5)
+
+    def test_tie_correction(self):
+        u, p = compare.mann_whitney(TIED_X, TIED_Y)
+        self.assertEqual(u, 5)
+        self.assertAlmostEqual(p, 0.07934, places=5)
+
+    def test_identical_samples(self):
+        u, p = compare.mann_whitney(np.ones(4), np.ones(3))
+        self.assertEqual(p, 1.0)
+
+
+class EffectSizesTest(unittest.TestCase):
+    def test_cliffs_delta(self):
+        for x, y in ((X, Y), (TIED_X, TIED_Y), (TIED_Y, TIED_X)):
+            u, _ = compare.mann_whitney(x, y)
+            diffs = np.subtract.outer(y, x)
+            expected = ((diffs > 0).sum() - (diffs < 0).sum()) / float(
+                diffs.size
+            )
+            self.assertAlmostEqual(
+                compare.effect_sizes(x, y, u)['cliffs_delta'], expected
+            )
+        u, _ = compare.mann_whitney(X, Y)
+        self.assertEqual(compare.effect_sizes(X, Y, u)['cliffs_delta'], 1)
+
+    def test_hodges_lehmann(self):
+        u, _ = compare.mann_whitney(X, Y)
+        self.assertEqual(compare.effect_sizes(X, Y, u)['hodges_lehmann'], 5)
+        u, _ = compare.mann_whitney(TIED_X, TIED_Y)
+        self.assertEqual(
+            compare.effect_sizes(TIED_X, TIED_Y, u)['hodges_lehmann'], 2.5
+        )
+
+
+class CompareCellTest(unittest.TestCase):
+    def test_missing_values_are_dropped(self):
+        base = [(i, {'duration': v}) for i, v in enumerate([1, None, 2])]
+        other = [(i, {'duration': v}) for i, v in enumerate([3, 4])]
+        result = compare.compare_cell(base, other, 'duration')
+        self.assertEqual(result['n'], [2, 2])
+
+    def test_too_few_runs(self):
+        base = [(0, {'duration': 1.0})]
+        other = [(1, {'duration': 2.0}), (2, {'duration': 3.0})]
+        self.assertEqual(compare.compare_cell(base, other, 'duration'),
+                         {'n': [1, 2]})
+
+
+if __name__ == '__main__':
+    unittest.main()
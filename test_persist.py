@@ -0,0 +1,108 @@
+#!/usr/bin/python
+import os
+import shutil
+import tempfile
+import unittest
+
+import pymongo
+
+import persist
+
+
+class FakeCollection(object):
+    def __init__(self, server):
+        self._server = server
+        self.docs = {}
+
+    def insert(self, docs, continue_on_error=False):
+        if not self._server.up:
+            raise pymongo.errors.AutoReconnect('server down')
+        duplicate = False
+        for doc in isinstance(docs, list) and docs or [docs]:
+            if doc['_id'] in self.docs:
+                duplicate = True
+                continue
+            self.docs[doc['_id']] = doc
+        if duplicate:
+            raise pymongo.errors.DuplicateKeyError('duplicate _id')
+
+    def find(self, query, projection):
+        ids = query['_id']['$in']
+        return [{'_id': i} for i in ids if i in self.docs]
+
+
+class FakeServer(object):
+    def __init__(self):
+        self.up = True
+        self.collections = {}
+
+    def __call__(self):
+        # Stands in for pymongo.MongoClient.
+        return {'apf': self}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection(self))
+
+
+class SpoolReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.server = FakeServer()
+        self._saved = pymongo.MongoClient, persist.RETRY_INTERVAL
+        pymongo.MongoClient = self.server
+        # A failed insert then waits for good: the writer is as stuck as a
+        # crashed process.
+        persist.RETRY_INTERVAL = 3600
+
+    def tearDown(self):
+        pymongo.MongoClient, persist.RETRY_INTERVAL = self._saved
+        shutil.rmtree(self.spool_dir)
+
+    def spooled(self, suffix='.pickle'):
+        return [name for name in os.listdir(self.spool_dir)
+                if name.endswith(suffix)]
+
+    def crash_while_down(self, records):
+        self.server.up = False
+        writer = persist.WriteBehind(self.spool_dir)
+        for record in records:
+            writer.put('results', record)
+        self.assertFalse(writer.flush(timeout=0.5))
+        self.server.up = True
+
+    def test_records_survive_a_crash(self):
+        self.crash_while_down([{'run': i} for i in range(3)])
+        self.assertEqual(len(self.spooled()), 3)
+
+        self.assertTrue(persist.WriteBehind(self.spool_dir).flush(5))
+        docs = self.server['results'].docs.values()
+        self.assertEqual(sorted(doc['run'] for doc in docs), [0, 1, 2])
+        self.assertEqual(self.spooled(), [])
+
+    def test_replay_after_insert_is_not_duplicated(self):
+        # Crashed after the insert, before the spool file was removed.
+        record = {'run': 0}
+        self.crash_while_down([record])
+        self.server['results'].docs[record['_id']] = dict(record)
+
+        self.assertTrue(persist.WriteBehind(self.spool_dir).flush(5))
+        self.assertEqual(len(self.server['results'].docs), 1)
+        self.assertEqual(self.spooled(), [])
+
+    def test_torn_spool_files(self):
+        # Crashed while writing: a partial .tmp is never replayed, and a
+        # truncated record is set aside.
+        with open(os.path.join(self.spool_dir, '1.pickle.tmp'), 'wb') as f:
+            f.write('\x80\x02')
+        with open(os.path.join(self.spool_dir, '2.pickle'), 'wb') as f:
+            f.write('\x80\x02')
+
+        self.assertTrue(persist.WriteBehind(self.spool_dir).flush(5))
+        self.assertEqual(self.server['results'].docs, {})
+        self.assertEqual(self.spooled(), [])
+        self.assertEqual(self.spooled('.bad'), ['2.pickle.bad'])
+        self.assertEqual(self.spooled('.tmp'), ['1.pickle.tmp'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/python
+import unittest
+
+import results
+
+
+def legacy_run(paths):
+    # A run recorded before 'devices' existed, files in the list layout.
+    files = [{'path': path, 'contents': '0 0 0 0'} for path in paths]
+    return {'files': {'guest': {'pre': files, 'post': list(files)}}}
+
+
+class GuestDataPathTest(unittest.TestCase):
+    def test_legacy_both_devices(self):
+        res = legacy_run([
+            '/sys/block/dm-0/stat',
+            '/sys/block/dm-2/stat',
+            '/sys/block/dm-3/stat',
+        ])
+        self.assertEqual(results.guest_data_path(res),
+                         '/sys/block/dm-3/stat')
+
+    def test_legacy_single_device(self):
+        res = legacy_run(['/sys/block/dm-0/stat', '/sys/block/dm-2/stat'])
+        self.assertEqual(results.guest_data_path(res),
+                         '/sys/block/dm-2/stat')
+
+    def test_discovered_devices(self):
+        res = legacy_run(['/sys/block/vda2/stat', '/sys/block/vdb/stat'])
+        res['devices'] = {
+            'guest': {'root': 'vda2', 'swap': None, 'data': ['vdb']},
+        }
+        self.assertEqual(results.guest_data_path(res),
+                         '/sys/block/vdb/stat')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+import unittest
+
+import stacks
+
+
+def event(name, preempt, frames):
+    # Same shape as perf_parse events: (name, fields, frames)
+    return (name, 'preempt_count=%d' % preempt, [(f,) for f in frames])
+
+
+class InternTableTest(unittest.TestCase):
+    def test_ids_follow_first_use(self):
+        table = stacks.InternTable(['a', 'b'])
+        self.assertEqual(table.intern('b'), 1)
+        self.assertEqual(table.intern('c'), 2)
+        self.assertEqual(list(table), ['a', 'b', 'c'])
+        self.assertEqual(table[2], 'c')
+
+
+class StackHistogramTest(unittest.TestCase):
+    def setUp(self):
+        self.hist = stacks.StackHistogram(['apache', 'node'], [256, 512])
+
+    def test_counts(self):
+        read = event('sched', 0, ['schedule', 'sys_read'])
+        irq = event('sched', 1, ['schedule', 'do_IRQ'])
+        self.hist.add(read, 'apache', 256)
+        self.hist.add(read, 'apache', 256, count=2)
+        self.hist.add(read, 'node', 512)
+        self.hist.add(irq, 'apache', 512, count=4)
+
+        counts = self.hist.counts()
+        self.assertEqual(counts.shape, (2, 2, 2))
+        self.assertEqual(counts[0].tolist(), [[3, 0], [0, 1]])
+        self.assertEqual(counts[1].tolist(), [[0, 4], [0, 0]])
+        self.assertEqual(counts.sum(), 8)
+
+    def test_same_stack_different_preempt_count(self):
+        self.hist.add(event('sched', 0, ['schedule']), 'apache', 256)
+        self.hist.add(event('sched', 3, ['schedule']), 'apache', 256)
+        self.assertEqual(len(self.hist.stacks), 2)
+        self.assertEqual(len(self.hist.frames), 1)
+
+    def test_frame_names(self):
+        stack_id = self.hist.intern_event(
+            event('sched', 0, ['schedule', 'sys_write'])
+        )
+        self.assertEqual(self.hist.frame_names(stack_id),
+                         ['schedule', 'sys_write'])
+
+    def test_top_is_stable(self):
+        for frame, count in [('a', 1), ('b', 5), ('c', 1), ('d', 5)]:
+            self.hist.add(event('sched', 0, [frame]), 'node', 256, count)
+        counts = self.hist.counts()
+        self.assertEqual(self.hist.top(counts).tolist(), [1, 3, 0, 2])
+        self.assertEqual(self.hist.top(counts, 2).tolist(), [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+import unittest
+
+import numpy as np
+
+import testrunner
+
+
+def sample_test():
+    pass
+
+
+def cell(mem_size):
+    return {
+        'machine_spec': {
+            'template_path': testrunner.TEMPLATE_CLEAN,
+            'mem_size': mem_size,
+        },
+        'test': {'func': sample_test},
+    }
+
+
+class RunningStatsTest(unittest.TestCase):
+    def test_matches_numpy(self):
+        # A large offset is where a naive sum of squares loses precision.
+        values = 1e9 + np.array([4.0, 7, 13, 16, 2.5, 9])
+        st = testrunner.RunningStats()
+        for value in values:
+            st.add(value)
+        self.assertEqual(st.n, len(values))
+        self.assertAlmostEqual(st.mean, values.mean(), places=4)
+        self.assertAlmostEqual(st.stddev() ** 2, values.var(ddof=1),
+                               places=6)
+
+    def test_relative_ci(self):
+        st = testrunner.RunningStats()
+        for value in (9.0, 10, 11):
+            st.add(value)
+        # t(2) * 1 / sqrt(3) / 10
+        self.assertAlmostEqual(st.relative_ci(), 4.303 / 3 ** 0.5 / 10)
+
+    def test_undefined_below_two_runs(self):
+        st = testrunner.RunningStats()
+        self.assertEqual(st.relative_ci(), float('inf'))
+        st.add(1.0)
+        self.assertEqual(st.stddev(), float('inf'))
+        self.assertEqual(st.relative_ci(), float('inf'))
+
+
+class TQuantileTest(unittest.TestCase):
+    def test_table(self):
+        self.assertEqual(testrunner.t_quantile(0), float('inf'))
+        self.assertEqual(testrunner.t_quantile(1), 12.706)
+        self.assertEqual(testrunner.t_quantile(10), 2.228)
+
+    def test_rounds_down_between_rows(self):
+        # Conservative: the quantile of the next smaller tabulated df.
+        self.assertEqual(testrunner.t_quantile(11), 2.228)
+        self.assertEqual(testrunner.t_quantile(1000), 1.980)
+
+
+class AdaptiveSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.done = {}
+        self.runs = []
+        self.durations = {}
+        self._saved = testrunner.completed_runs, testrunner.run_test
+        testrunner.completed_runs = lambda keys: dict(self.done)
+        testrunner.run_test = self.run_test
+
+    def tearDown(self):
+        testrunner.completed_runs, testrunner.run_test = self._saved
+
+    def run_test(self, tags, run_key, machine_spec, test):
+        mem_size = machine_spec['mem_size']
+        self.runs.append((mem_size, run_key))
+        return {'duration': self.durations[mem_size].pop(0)}
+
+    def count(self, mem_size):
+        return len([run for run in self.runs if run[0] == mem_size])
+
+    def test_budget_goes_to_the_noisy_cell(self):
+        cells = [cell(256), cell(512)]
+        self.durations = {256: [10.0] * 60, 512: [10.0, 20.0] * 30}
+        testrunner.adaptive_sweep(cells, budget=20)
+        self.assertEqual(self.count(256), testrunner.MIN_ITERS)
+        self.assertEqual(self.count(512), 20 - testrunner.MIN_ITERS)
+        # Warm-up alternates between the cells.
+        self.assertEqual([m for m, _ in self.runs[:4]],
+                         [256, 512, 256, 512])
+
+    def test_stops_at_max_iters(self):
+        self.durations = {256: [10.0, 20.0] * 60}
+        testrunner.adaptive_sweep([cell(256)], budget=100)
+        self.assertEqual(self.count(256), testrunner.MAX_ITERS)
+
+    def test_resumes_completed_runs(self):
+        c = cell(256)
+        self.done = {
+            testrunner.run_key(c, 0): 10.0,
+            # No duration, but still one of the cell's iterations.
+            testrunner.run_key(c, 1): None,
+        }
+        self.durations = {256: [10.0] * 60}
+        testrunner.adaptive_sweep([c], budget=10)
+        self.assertEqual(
+            [key for _, key in self.runs],
+            [testrunner.run_key(c, i) for i in range(2, 6)],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
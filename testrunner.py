@@ -1,26 +1,58 @@
 #!/usr/bin/python
 import datetime
+import errno
+import fcntl
 import functools
+import hashlib
+import itertools
+import json
 import logging
 import os
-import shutil
+import random
+import re
+import socket
 import subprocess
-# import sys
+import sys
 import tempfile
+import threading
 import time
+import traceback
 import uuid
 
 import libvirt
 import pymongo
+import agent
+import blobstore
+import domain
+import images
 import minimemslap as mms
+import persist
+import reaper
+import schema
+import virt
 
 DEVNULL = '/dev/null'
 IP_PREFIX = '192.168.222.'
 MAC_PREFIX = '52:54:00:33:44:'
-CGROUP_MEM_FMT = (
-    '/sys/fs/cgroup/memory/machine.slice/'
-    'machine-qemu\\x2d%s.scope'
-)
+KSM_RUN_PATH = '/sys/kernel/mm/ksm/run'
+# Every run holds this shared; a ksm=True run takes it exclusively, as it
+# changes the host-wide KSM setting under any other runner.
+HOST_LOCK_PATH = '/var/lock/apf-host.lock'
+# How long to wait for sshd between checks that the VM is still up.
+SSH_PROBE_INTERVAL = 1
+# How long to wait for libvirt to report a destroyed VM stopped.
+DESTROY_TIMEOUT = 5
+# Run guest control commands through qemu-ga when the template has it,
+# leaving the network to the benchmark; ssh otherwise.
+USE_AGENT = True
+
+
+class InfrastructureError(Exception):
+    pass
+
+
+class WorkloadError(Exception):
+    pass
 
 
 def logged(func):
@@ -52,43 +84,25 @@ _name_to_ip = get_db('ip-vm_name')
 def alloc_ip(name):
     allocated_suffixes = [ip_suffix(row['ip']) for row in _name_to_ip.find()]
     sfx = (set(allocated_suffixes) ^ set(range(2, 220))).pop()
-    _name_to_ip.insert({'ip': ip(sfx), 'vm_name': name})
+    _name_to_ip.insert({
+        'ip': ip(sfx),
+        'vm_name': name,
+        # Lets collect_stale tell a crashed runner from a running one.
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'time': time.time(),
+    })
     return ip(sfx)
 
 
 def free_ip(name):
     _name_to_ip.remove({'vm_name': name})
 
-_libvirt_con = None
-
-
-def get_libvirt_conn():
-    global _libvirt_con
-    if _libvirt_con is None:
-        _libvirt_con = libvirt.open()
-    return _libvirt_con
-
 
 def get_rand_name():
     return str(uuid.uuid4())[:8]
 
 
-def create_image_from_template(template_path, output_path):
-    with open(DEVNULL, 'w') as f:
-        subprocess.check_call(
-            [
-                "qemu-img",
-                "create",
-                "-f", "qcow2",
-                "-b", os.path.abspath(template_path),
-                output_path,
-            ],
-            stdout=f,
-            stderr=f,
-        )
-    os.chmod(output_path, 0o777)
-
-
 class Timer:
     def __init__(self, timeout=None):
         self._timeout = timeout
@@ -109,61 +123,232 @@ class Timer:
         return time.time() - self._start_time
 
 
+class HostProbe:
+    # Keeps the host files open and re-reads them from offset 0, which makes
+    # sysfs regenerate the contents (os.pread is python 3 only, so this is
+    # an unbuffered seek + read). Readings are stored as integer deltas
+    # from the first one; while used as a context manager it also samples
+    # every `interval` seconds.
+    def __init__(self, paths, interval=None):
+        self.paths = paths
+        self._interval = interval
+        self._files = self._open(paths)
+        self._stop = threading.Event()
+        self._base = None
+        self.times = []
+        self.deltas = [[] for _ in paths]
+
+    def _open(self, paths):
+        return [open(path, 'rb', 0) for path in paths]
+
+    def _sample(self):
+        values = []
+        for f in self._files:
+            f.seek(0)
+            values.append([int(e) for e in f.read(4096).split()])
+        return values
+
+    def read(self):
+        now = time.time()
+        values = self._sample()
+        if self._base is None:
+            self._base = values
+        self.times.append(now)
+        for deltas, base, current in zip(self.deltas, self._base, values):
+            deltas.append([c - b for b, c in zip(base, current)])
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.read()
+
+    def __enter__(self):
+        if self._interval:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def __exit__(self, *a, **kw):
+        if self._interval:
+            self._stop.set()
+            self._thread.join()
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+    def summary(self):
+        return {
+            'times': self.times,
+            'stats': [
+                {'path': path, 'deltas': deltas}
+                for path, deltas in zip(self.paths, self.deltas)
+            ],
+        }
+
+
+class GuestProbe(HostProbe):
+    # The same readings of guest files through vm.read_file. Only sample
+    # periodically over the agent channel: over ssh the reads would share
+    # the network with the benchmark. A failed reading is skipped.
+    def __init__(self, vm, paths, interval=None):
+        self._vm = vm
+        HostProbe.__init__(self, paths, interval)
+
+    def _open(self, paths):
+        return []
+
+    def _sample(self):
+        return [[int(e) for e in self._vm.read_file(path).split()]
+                for path in self.paths]
+
+    def read(self):
+        try:
+            HostProbe.read(self)
+        except IOError as e:
+            logging.warning('guest sample failed: %s', e)
+
+
+class BalloonSchedule:
+    # Moves the balloon target at (seconds from the start, MiB) points
+    # while used as a context manager.
+    def __init__(self, vm, schedule):
+        self._vm = vm
+        self._schedule = sorted(schedule or [])
+        self._stop = threading.Event()
+        self.events = []
+
+    def _run(self):
+        start = time.time()
+        for offset, target in self._schedule:
+            if self._stop.wait(max(start + offset - time.time(), 0)):
+                return
+            self._vm.set_balloon(target)
+            self.events.append({'time': time.time(), 'target': target})
+
+    def __enter__(self):
+        if self._schedule:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def __exit__(self, *a, **kw):
+        if self._schedule:
+            self._stop.set()
+            self._thread.join()
+
+
+def guest_clock(vm):
+    # perf timestamps follow the guest's boot clock; pair it with host time.
+    before = time.time()
+    ret = vm.execute(['cat', '/proc/uptime'])
+    after = time.time()
+    if ret[0] != 0:
+        return None
+    return {
+        'host_time': (before + after) / 2,
+        'guest_uptime': float(ret[1].split()[0]),
+    }
+
+
 class TestVM:
-    def __init__(self, template_path, mem_size, name=None, ip=None):
+    def __init__(self, template_path, mem_size, name=None, ip=None,
+                 **features):
+        unknown = set(features) - set(schema.DOMAIN_DEFAULTS)
+        if unknown:
+            raise TypeError('unknown machine_spec keys %s' % sorted(unknown))
         self._template_path = template_path
         self._mem_size = mem_size
+        self._features = dict(schema.DOMAIN_DEFAULTS, **features)
+        if isinstance(self._features['cpuset'], list) and \
+                len(self._features['cpuset']) != self._features['vcpus']:
+            raise ValueError('cpuset needs one host CPU per vCPU')
         self.name = name and name or get_rand_name()
         self.ip = ip
+        self.agent = None
         self.ssh_history = []
+        self._ksm_run = None
+        self._host_lock = None
+
+    @property
+    def balloon(self):
+        return self._features['balloon']
 
     def _provision(self):
         disk_path = os.path.join(self.prefix, 'disk.img')
-        create_image_from_template(self._template_path, disk_path)
+        self.template_sha1 = images.create_overlay(
+            self._template_path,
+            disk_path,
+        )
 
         if self.ip is None:
             self.ip = alloc_ip(self.name)
 
-        with open('dom_template.xml') as f:
-            template = f.read()
-
-        subs = {
-            'name': self.name,
-            'mem_size': self._mem_size,
-            'disk_path': disk_path,
-            'mac_addr': ip_to_mac(self.ip),
-        }
-        for k, v in subs.items():
-            template = template.replace('@%s@' % (k.upper()), str(v))
-
-        with open('/tmp/last_dom.xml', 'w') as f:
-            f.write(template)
-
-        get_libvirt_conn().createXML(template)
+        self.domain_xml = domain.build(
+            self.name,
+            self._mem_size,
+            disk_path,
+            ip_to_mac(self.ip),
+            self._features,
+        )
+        with open(os.path.join(self.prefix, 'domain.xml'), 'w') as f:
+            f.write(self.domain_xml)
+
+        if self._features['ksm']:
+            # Put back on teardown: runs at the default (None) must see the
+            # host setting unchanged.
+            with open(KSM_RUN_PATH) as f:
+                self._ksm_run = f.read().strip()
+            with open(KSM_RUN_PATH, 'w') as f:
+                f.write('1')
+        # Registered before the domain exists, so 'started' is not missed.
+        virt.get_events()
+        virt.get_conn().createXML(self.domain_xml)
+
+    def set_balloon(self, mem_size):
+        virt.get_conn().lookupByName(self.name).setMemory(mem_size * 1024)
 
     def set_cgroup_memory_limit(self, limit_in_mbytes):
-        path = os.path.join(
-            CGROUP_MEM_FMT % self.name,
-            'memory.limit_in_bytes',
+        # libvirt writes memory.limit_in_bytes of the domain's cgroup.
+        virt.get_conn().lookupByName(self.name).setMemoryParameters(
+            {libvirt.VIR_DOMAIN_MEMORY_HARD_LIMIT: limit_in_mbytes * 1024},
+            libvirt.VIR_DOMAIN_AFFECT_LIVE,
         )
-        limit_in_bytes = str(limit_in_mbytes * (2 ** 20))
 
-        while True:
-            try:
-                with open(path, 'w') as f:
-                    f.write(limit_in_bytes)
-                break
-            except IOError:
-                continue
+    @property
+    def lifecycle(self):
+        return virt.get_events().history(self.name)
+
+    def down_event(self):
+        # The lifecycle event that took the VM down, if any.
+        for event in self.lifecycle:
+            if event['event'] in virt.DOWN_EVENTS:
+                return event
+
+    def _sshd_listening(self):
+        try:
+            socket.create_connection((self.ip, 22), SSH_PROBE_INTERVAL).close()
+            return True
+        except socket.error:
+            return False
 
     def _wait_for_ssh(self, timeout=60):
+        # No ssh processes until sshd accepts connections; the wait between
+        # probes ends early if the VM goes down.
+        events = virt.get_events()
         with Timer(timeout) as timer:
             while not timer.expired():
-                ret = self.ssh(['true'])
-                if ret[0] == 0:
+                if self._sshd_listening() and self.ssh(['true'])[0] == 0:
                     self.ssh_history = []
                     return
-            raise RuntimeError('Remote shell unavailable')
+                down = events.wait(self.name, virt.DOWN_EVENTS,
+                                   SSH_PROBE_INTERVAL)
+                if down is not None:
+                    raise InfrastructureError(
+                        'VM %s while booting' % down['event']
+                    )
+            raise InfrastructureError('Remote shell unavailable')
 
     def ssh(self, command, background=False):
         ssh_command = [
@@ -195,6 +380,37 @@ class TestVM:
             })
             return (proc.returncode, out, err)
 
+    def execute(self, command):
+        # Same semantics as ssh(): the words are joined into one shell
+        # command line.
+        if self.agent is None:
+            return self.ssh(command)
+        try:
+            ret = self.agent.execute(['/bin/sh', '-c', ' '.join(command)])
+        except agent.AgentError as e:
+            ret = (255, '', str(e))
+        self.ssh_history.append({
+            'command': command,
+            'channel': 'agent',
+            'return_code': ret[0],
+            'stdout': ret[1],
+            'stderr': ret[2],
+        })
+        return ret
+
+    def read_file(self, remote_path):
+        if self.agent is not None:
+            try:
+                return self.agent.read_file(remote_path)
+            except agent.AgentError as e:
+                raise IOError(str(e))
+        local_path = os.path.join(self.prefix, 'tmp')
+        self.scp_from(remote_path, local_path)
+        with open(local_path) as f:
+            data = f.read()
+        os.unlink(local_path)
+        return data
+
     def _scp(self, path1, path2):
         command = [
             "scp",
@@ -223,33 +439,131 @@ class TestVM:
             "root@%s:%s" % (self.ip, remote_path),
         )
 
+    def _lock_host(self):
+        self._host_lock = open(HOST_LOCK_PATH, 'a')
+        fcntl.flock(
+            self._host_lock,
+            self._features['ksm'] and fcntl.LOCK_EX or fcntl.LOCK_SH,
+        )
+
+    def _unlock_host(self):
+        if self._host_lock is not None:
+            self._host_lock.close()
+            self._host_lock = None
+
+    def _restore_ksm(self):
+        if self._ksm_run is not None:
+            with open(KSM_RUN_PATH, 'w') as f:
+                f.write(self._ksm_run)
+            self._ksm_run = None
+
     def _destroy(self):
-        free_ip(self.name)
-        get_libvirt_conn().lookupByName(self.name).destroy()
+        try:
+            try:
+                virt.get_conn().lookupByName(self.name).destroy()
+            except libvirt.libvirtError as e:
+                # Transient domains are gone once they stop (or were never
+                # created).
+                if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+            else:
+                virt.get_events().wait(self.name, virt.DOWN_EVENTS,
+                                       DESTROY_TIMEOUT)
+        finally:
+            try:
+                virt.get_events().forget(self.name)
+            finally:
+                free_ip(self.name)
+
+    def _teardown(self, failing):
+        # Cleanup errors are only raised when they don't replace the
+        # exception a run is failing with.
+        try:
+            try:
+                self._destroy()
+            finally:
+                try:
+                    self._restore_ksm()
+                finally:
+                    self._unlock_host()
+        except Exception:
+            if not failing:
+                raise
+            logging.exception('teardown of %s failed', self.name)
+        finally:
+            reaper.get_reaper().reap(self.prefix)
 
     def __enter__(self):
         self.prefix = tempfile.mkdtemp(prefix=_PREFIXED('.'),
                                        suffix='-%s' % self.name)
         try:
             os.chmod(self.prefix, 0o777)
+            self._lock_host()
             self._provision()
-            try:
-                self._wait_for_ssh()
-            except:
-                self._destroy()
-                raise
+            self._wait_for_ssh()
+            if USE_AGENT:
+                self.agent = agent.connect(self.name)
         except:
-            shutil.rmtree(self.prefix)
-            raise
+            exc_info = sys.exc_info()
+            self._teardown(failing=True)
+            raise exc_info[0], exc_info[1], exc_info[2]
         return self
 
     def __exit__(self, type, value, tb):
-        self._destroy()
-        shutil.rmtree(self.prefix)
+        self._teardown(failing=type is not None)
+
+
+# TestVM.prefix is '.<mkdtemp suffix>-<vm name>' in the images directory.
+PREFIX_RE = re.compile(r'^\.\w{6}-(?P<name>[0-9a-f]{8})$')
+
+
+# Other runners may have created a prefix and lease but not the domain
+# yet; only leftovers older than this are theirs to have abandoned.
+STALE_AFTER = 60 * 60
+
+
+def owner_alive(row):
+    # None when the lease was taken on another host (or before leases
+    # recorded their owner).
+    if row.get('host') != socket.gethostname() or 'pid' not in row:
+        return None
+    try:
+        os.kill(row['pid'], 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def collect_stale():
+    # Run prefixes and IP leases left behind by crashed runs, whose VM is
+    # no longer running.
+    live = set(dom.name() for dom in virt.get_conn().listAllDomains())
+    root = _PREFIXED('')
+    kept = set()
+    for entry in os.listdir(root):
+        match = PREFIX_RE.match(entry)
+        if not match or match.group('name') in live:
+            continue
+        path = os.path.join(root, entry)
+        if time.time() - os.path.getmtime(path) > STALE_AFTER:
+            print 'reaping stale prefix %s' % entry
+            reaper.get_reaper().reap(path)
+        else:
+            kept.add(match.group('name'))
+    for row in _name_to_ip.find():
+        name = row['vm_name']
+        if name in live or name in kept:
+            continue
+        alive = owner_alive(row)
+        if alive is None:
+            alive = time.time() - row.get('time', 0) <= STALE_AFTER
+        if not alive:
+            print 'freeing stale lease %s' % row['ip']
+            free_ip(name)
 
 
 def apache_test(vm, requests, concurrency):
-    vm.ssh('sysctl -w vm.swappiness=0'.split(' '))
+    vm.execute('sysctl -w vm.swappiness=0'.split(' '))
     print 'Running ab'
     url = 'http://%s/index2.php' % (vm.ip)
     proc = subprocess.Popen(
@@ -273,9 +587,9 @@ def apache_test(vm, requests, concurrency):
 
 
 def node_test(vm, requests, concurrency):
-    vm.ssh('sysctl -w vm.swappiness=0'.split(' '))
-    vm.ssh('sysctl -w net.nf_conntrack_max=131072'.split(' '))
-    vm.ssh('sysctl -w net.netfilter.nf_conntrack_max=1310720'.split(' '))
+    vm.execute('sysctl -w vm.swappiness=0'.split(' '))
+    vm.execute('sysctl -w net.nf_conntrack_max=131072'.split(' '))
+    vm.execute('sysctl -w net.netfilter.nf_conntrack_max=1310720'.split(' '))
     print 'Running ab'
     url = 'http://%s:8080/get' % (vm.ip)
     proc = subprocess.Popen(
@@ -303,7 +617,7 @@ def memcached_setup(vm, count, value_size):
 
 
 def memcached_test_mini(vm, count, key_limit, concurrency):
-    vm.ssh('sysctl -w vm.swappiness=0'.split(' '))
+    vm.execute('sysctl -w vm.swappiness=0'.split(' '))
     print 'Running mini-memslap'
     start = time.time()
     mms.parallel_slap(vm.ip, count, key_limit, concurrency)
@@ -312,7 +626,7 @@ def memcached_test_mini(vm, count, key_limit, concurrency):
 
 
 def pgbench_test(vm, scale, clients, transactions):
-    vm.ssh('sysctl -w vm.swappiness=0'.split(' '))
+    vm.execute('sysctl -w vm.swappiness=0'.split(' '))
     print 'Running pgbench'
     start = time.time()
     proc = subprocess.Popen(
@@ -338,15 +652,86 @@ def pgbench_test(vm, scale, clients, transactions):
     }
 
 
+def run_workload(func, *args, **kwargs):
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        raise WorkloadError('%s: %s' % (type(e).__name__, e)), \
+            None, sys.exc_info()[2]
+    if isinstance(result, dict) and result.get('exitcode'):
+        raise WorkloadError('exit code %d' % result['exitcode'])
+    return result
+
+
+def parse_devices(swaps, lsblk, data_mounts=()):
+    # Block devices by role as kernel names (dm-1, vda2, ...), from
+    # /proc/swaps and `lsblk -rno NAME,KNAME,TYPE,MOUNTPOINT`. 'data' holds
+    # the devices mounted at data_mounts, in that order.
+    swap_names = [
+        os.path.basename(line.split()[0])
+        for line in swaps.splitlines()[1:]
+        if line.split()[1:2] == ['partition']
+    ]
+    knames = {}
+    data = {}
+    devices = {'root': None, 'swap': None, 'data': []}
+    for line in lsblk.splitlines():
+        fields = line.split(' ')
+        if len(fields) < 3:
+            continue
+        name, kname = fields[0], fields[1]
+        mountpoint = (fields[3:4] or [''])[0].decode('string_escape')
+        knames[name] = knames[kname] = kname
+        if mountpoint == '/':
+            devices['root'] = kname
+        elif mountpoint in data_mounts:
+            data[mountpoint] = kname
+    devices['data'] = [data[m] for m in data_mounts if m in data]
+    swaps = [knames[name] for name in swap_names if name in knames]
+    devices['swap'] = swaps and swaps[0] or None
+    return devices
+
+
+LSBLK_COMMAND = ['lsblk', '-rno', 'NAME,KNAME,TYPE,MOUNTPOINT']
+# Where the workloads' files live in the guest: the home volume of the
+# templates' default LVM layout.
+GUEST_DATA_MOUNTS = ('/home',)
+
+
+def host_devices():
+    with open('/proc/swaps') as f:
+        swaps = f.read()
+    return parse_devices(swaps, subprocess.check_output(LSBLK_COMMAND))
+
+
+def guest_devices(vm):
+    swaps = vm.execute(['cat', '/proc/swaps'])
+    lsblk = vm.execute(LSBLK_COMMAND)
+    if swaps[0] != 0 or lsblk[0] != 0:
+        raise InfrastructureError('Device discovery failed')
+    return parse_devices(swaps[1], lsblk[1], GUEST_DATA_MOUNTS)
+
+
+def check_host():
+    # Every run probes the host's swap device; swap files and swapless
+    # hosts have none.
+    if host_devices()['swap'] is None:
+        raise InfrastructureError('host has no swap partition to probe')
+
+
+block_stat_path = lambda dev: '/sys/block/%s/stat' % dev
+
+
+def device_files(devices):
+    devs = [devices['root'], devices['swap']] + devices['data']
+    return [block_stat_path(dev) for dev in devs if dev]
+
+
 def collect_files(vm, files):
     records = {}
     for path in files:
         try:
-            local_path = os.path.join(vm.prefix, 'tmp')
-            vm.scp_from(path, local_path)
-            with open(local_path) as f:
-                records[path] = f.read()
-            os.unlink(local_path)
+            records[path] = vm.read_file(path)
         except IOError:
             print 'failed to copy %s' % path
     return records
@@ -360,7 +745,9 @@ def run_test(test, machine_spec,
              files_pre=None,
              files_post=None,
              host_files=None,
-             tags=[]):
+             sample_interval=None,
+             tags=[],
+             run_key=None):
 
     files = files or []
     files_pre = files_pre or []
@@ -373,115 +760,141 @@ def run_test(test, machine_spec,
 
     with TestVM(**machine_spec) as vm:
         print 'VM is up'
+        devices = {
+            'host': host_devices(),
+            'guest': guest_devices(vm),
+        }
+        files_pre += device_files(devices['guest'])
+        files_post += device_files(devices['guest'])
+        host_swap = block_stat_path(devices['host']['swap'])
+        host_files = [host_swap] + host_files
+
         files_pre_records = collect_files(vm, files_pre)
-        host_files_pre_records = []
-        for path in host_files:
-            with open(path) as f:
-                host_files_pre_records.append(
-                    {
-                        'path': path,
-                        'contents': f.read(),
-                    },
-                )
-        print 'Pre-files collected'
-
-        # FIXME:
-        vm.ssh('systemctl restart systemd-sysctl'.split(' '))
-        if 'setup' in test:
-            test['setup'](vm)
-        if cgroup_limit:
-            vm.set_cgroup_memory_limit(cgroup_limit)
-        if perf:
-            perf_command = ["perf", "record", "-a", "-g"]
-            if 'user' in perf:
-                perf_command.extend(["-u", perf['user']])
-            for event in perf.get('events', []):
-                perf_command.extend(["-e", event])
-            vm.ssh([
-                'nohup %s 1>/dev/null 2>/dev/null &' % (' '.join(perf_command))
-            ])
-
-        duration = result = None
+        probe = HostProbe(host_files, sample_interval)
         try:
-            with Timer() as timer:
-                print 'run test'
-                result = test['func'](vm,
-                                      *test.get('args', []),
-                                      **test.get('kwargs', {}))
-                print 'test done'
-                duration = timer.elapsed()
-
-        finally:
+            probe.read()
+            guest_probe = GuestProbe(vm, device_files(devices['guest']),
+                                     vm.agent and sample_interval)
+            guest_probe.read()
+            print 'Pre-files collected'
+
+            # FIXME:
+            vm.execute('systemctl restart systemd-sysctl'.split(' '))
+            if 'setup' in test:
+                run_workload(test['setup'], vm)
             if cgroup_limit:
-                vm.set_cgroup_memory_limit(4096)
-
-            # vm.ssh(['dmesg'])
-            # print 'done dmesg'
-
+                vm.set_cgroup_memory_limit(cgroup_limit)
             if perf:
-                vm.ssh('pkill -SIGTERM perf'.split(' '))
-                while vm.ssh('pgrep ^perf'.split(' '))[0] == 0:
-                    continue
-                vm.ssh(
-                    ['perf script -i /root/perf.data | tee /tmp/perf.script']
-                )
-
-                perf_local_path = os.path.join(vm.prefix, 'perf.script')
-                vm.scp_from('/tmp/perf.script', perf_local_path)
-                with open(perf_local_path) as f:
-                    perf['output'] = f.read()
-            files_post_records = collect_files(vm, files_post)
-            host_files_post_records = []
-            for path in host_files:
-                with open(path) as f:
-                    host_files_post_records.append(
-                        {
-                            'path': path,
-                            'contents': f.read(),
-                        },
+                perf_command = ["perf", "record", "-a", "-g"]
+                if 'user' in perf:
+                    perf_command.extend(["-u", perf['user']])
+                for event in perf.get('events', []):
+                    perf_command.extend(["-e", event])
+                vm.execute([
+                    'nohup %s 1>/dev/null 2>/dev/null &' %
+                    (' '.join(perf_command))
+                ])
+
+            clock = guest_clock(vm)
+            balloon = BalloonSchedule(vm, vm.balloon)
+            duration = result = None
+            start_time = end_time = None
+            error = None
+            try:
+                with Timer() as timer:
+                    print 'run test'
+                    start_time = time.time()
+                    with probe, guest_probe, balloon:
+                        result = run_workload(test['func'], vm,
+                                              *test.get('args', []),
+                                              **test.get('kwargs', {}))
+                    end_time = time.time()
+                    print 'test done'
+                    duration = timer.elapsed()
+            except BaseException as e:
+                error = e
+                down = vm.down_event()
+                if isinstance(e, WorkloadError) and down is not None:
+                    # The workload failed because the VM went away under it.
+                    error = InfrastructureError(
+                        'VM %s during the test: %s' % (down['event'], e)
                     )
-            vm.ssh(['uname', '-a'])
-            vm.ssh(['dmesg'])
-
-            record = {
-                'test': {
-                    'name': test['func'].__name__,
-                    'result': result,
-                    'args': test.get('args', []),
-                    'kwargs': test.get('kwargs', {}),
-                },
-                'timestamp': str(datetime.datetime.now()),
-                'duration': duration,
-                'machine_spec': machine_spec,
-                'cgroup_limit': cgroup_limit,
-                'perf': perf,
-                'tags': tags,
-                'ssh_history': vm.ssh_history,
-                'files': {
-                    'host': {
-                        'pre': host_files_pre_records,
-                        'post': host_files_post_records,
+                    raise error, None, sys.exc_info()[2]
+                raise
+            finally:
+                if cgroup_limit:
+                    vm.set_cgroup_memory_limit(4096)
+
+                # vm.ssh(['dmesg'])
+                # print 'done dmesg'
+
+                if perf:
+                    vm.execute('pkill -SIGTERM perf'.split(' '))
+                    while vm.execute('pgrep ^perf'.split(' '))[0] == 0:
+                        continue
+                    vm.execute([
+                        'perf script -i /root/perf.data | '
+                        'tee /tmp/perf.script'
+                    ])
+                    perf['output'] = vm.read_file('/tmp/perf.script')
+                files_post_records = collect_files(vm, files_post)
+                probe.read()
+                guest_probe.read()
+                vm.execute(['uname', '-a'])
+                vm.execute(['dmesg'])
+
+                record = {
+                    'schema_version': schema.SCHEMA_VERSION,
+                    'test': {
+                        'name': test['func'].__name__,
+                        'result': result,
+                        'args': test.get('args', []),
+                        'kwargs': test.get('kwargs', {}),
                     },
-                    'guest': {
-                        'pre': files_pre_records,
-                        'post': files_post_records,
+                    'timestamp': str(datetime.datetime.now()),
+                    'duration': duration,
+                    'machine_spec': machine_spec,
+                    'template_sha1': vm.template_sha1,
+                    'domain_xml': vm.domain_xml,
+                    'cgroup_limit': cgroup_limit,
+                    'devices': devices,
+                    'balloon': balloon.events,
+                    'clock': clock,
+                    'timing': {
+                        'start': start_time,
+                        'end': end_time,
                     },
-                },
-            }
-            open('/tmp/foobar', 'w').write(repr(record))
-            get_db('results').insert(record)
-            return record
+                    'perf': perf,
+                    'tags': tags,
+                    'run_key': run_key,
+                    'ssh_history': vm.ssh_history,
+                    'control': vm.agent and 'agent' or 'ssh',
+                    'lifecycle': vm.lifecycle,
+                    'files': {
+                        'host': {
+                            'probe': probe.summary(),
+                        },
+                        'guest': {
+                            'probe': guest_probe.summary(),
+                            'pre': files_pre_records,
+                            'post': files_post_records,
+                        },
+                    },
+                }
+                record.update(schema.labels(machine_spec))
+                if error is not None:
+                    # Failed runs are recorded by the retry policy instead.
+                    error.record = record
+        finally:
+            probe.close()
+
+    blobstore.externalize(record, blobstore.get_store())
+    persist.get_writer().put('results', record)
+    return record
 
 MEM_SIZES = (256, 277, 298, 320, 341, 362, 384, 512, 1024, 2048)
 MEM_SIZES = (256, 298, 341, 384, 512, 1024, 2048)
 MEM_SIZES = (1024, 2048)
-GUEST_FILES = [
-    '/sys/block/dm-0/stat',  # root
-    '/sys/block/dm-1/stat',  # swap
-    '/sys/block/dm-2/stat',  # rand-files
-    '/sys/block/dm-3/stat',  # rand-files - occasional
-]
-HOST_FILES = ['/sys/block/dm-1/stat']
 APACHE_TEST = {
     'func': apache_test,
     'kwargs': {
@@ -536,58 +949,303 @@ TEMPLATE_FIX = _PREFIXED('fedora20-withfix7.qcow2.template')
 TEMPLATE_NOFIX = _PREFIXED('fedora20-withoutfix7.qcow2.template')
 
 ITERS = 20
+SAMPLE_INTERVAL = 0.5
+
+# Hypervisor features swept for the fix/nofix cells, crossed with each
+# other and with the cgroup limits; see schema.DOMAIN_DEFAULTS.
+DOMAIN_AXES = {
+    'hugepages': [False],
+    'ksm': [None],
+    'disk_bus': ['virtio'],
+    'disk_cache': ['none'],
+    'balloon': [None],
+    'vcpus': [1],
+    'cpuset': [None],
+    'emulator_cpuset': [None],
+    'numa_nodeset': [None],
+    'numa_mode': ['strict'],
+}
 
+# Adaptive sweeps: every cell gets MIN_ITERS runs, then the remaining
+# budget goes to the cell whose duration CI is widest relative to its mean
+# until all cells are below CI_TARGET or hit MAX_ITERS.
+MIN_ITERS = 5
+MAX_ITERS = 60
+CI_TARGET = 0.02
+
+# Failed runs are retried with capped exponential backoff, up to a limit
+# per failure kind; a cell whose runs give up QUARANTINE_AFTER times in a
+# row is skipped for the rest of the sweep.
+RETRY_LIMITS = {
+    'infrastructure': 5,
+    'workload': 2,
+}
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 300
+QUARANTINE_AFTER = 3
+
+# Two-sided 95% Student t quantiles by degrees of freedom.
+T_95 = [
+    (1, 12.706), (2, 4.303), (3, 3.182), (4, 2.776), (5, 2.571),
+    (6, 2.447), (7, 2.365), (8, 2.306), (9, 2.262), (10, 2.228),
+    (12, 2.179), (15, 2.131), (20, 2.086), (25, 2.060), (30, 2.042),
+    (40, 2.021), (60, 2.000), (120, 1.980),
+]
 
-def main(test, test_user):
-    # do 'optimum' runs
-    for mem_size in MEM_SIZES:
-        for i in range(ITERS):
-            run_test(
-                machine_spec={
-                    'template_path': TEMPLATE_CLEAN,
-                    'mem_size': mem_size,
-                },
-                test=test,
-                files=GUEST_FILES,
-                host_files=HOST_FILES,
-                tags=['%d/%d' % (i, ITERS)]
-            )
 
+def t_quantile(df):
+    return [t for d, t in T_95 if d <= df][-1] if df >= 1 else float('inf')
+
+
+class RunningStats:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (value - self.mean)
+
+    def stddev(self):
+        if self.n < 2:
+            return float('inf')
+        return (self._m2 / (self.n - 1)) ** 0.5
+
+    def relative_ci(self):
+        if self.n < 2 or not self.mean:
+            return float('inf')
+        half_width = t_quantile(self.n - 1) * self.stddev() / self.n ** 0.5
+        return half_width / abs(self.mean)
+
+
+def sweep_cells(test, test_user):
+    # 'optimum' runs first, then the fix/nofix runs under cgroup pressure.
+    cells = []
+    for mem_size in MEM_SIZES:
+        cells.append({
+            'machine_spec': {
+                'template_path': TEMPLATE_CLEAN,
+                'mem_size': mem_size,
+            },
+            'test': test,
+        })
+
+    axes = sorted(DOMAIN_AXES)
     for template in (
         TEMPLATE_FIX,
         TEMPLATE_NOFIX,
     ):
-        for cgroup_limit in MEM_SIZES:
-            for i in range(ITERS):
-                while True:
-                    try:
-                        run_test(
-                            machine_spec={
-                                'template_path': template,
-                                'mem_size': 2048,
-                            },
-                            test=test,
-                            cgroup_limit=cgroup_limit,
-                            perf={
-                                'events': ['sched:kvm_will_halt'],
-                                'user': test_user,
-                            },
-                            files=GUEST_FILES,
-                            host_files=HOST_FILES,
-                            tags=['%d/%d' % (i, ITERS)]
-                        )
-                        break
-                    except Exception:
-                        print 'retrying'
-                        logging.exception('a')
-                        continue
-                    except KeyboardInterrupt:
-                        time.sleep(1)
-                        continue
+        for values in itertools.product(*[DOMAIN_AXES[k] for k in axes]):
+            for cgroup_limit in MEM_SIZES:
+                machine_spec = {
+                    'template_path': template,
+                    'mem_size': 2048,
+                }
+                machine_spec.update(zip(axes, values))
+                cells.append({
+                    'machine_spec': machine_spec,
+                    'test': test,
+                    'cgroup_limit': cgroup_limit,
+                    'perf': {
+                        'events': ['sched:kvm_will_halt'],
+                        'user': test_user,
+                    },
+                    'sample_interval': SAMPLE_INTERVAL,
+                })
+    return cells
+
+
+def run_key(cell, iteration):
+    # Identifies a planned run of the sweep across restarts.
+    test = cell['test']
+    manifest = [
+        test['func'].__name__,
+        test.get('args', []),
+        test.get('kwargs', {}),
+        os.path.basename(cell['machine_spec']['template_path']),
+        cell['machine_spec']['mem_size'],
+        cell.get('cgroup_limit'),
+        iteration,
+    ]
+    # Left out at their defaults so keys of earlier sweeps still match.
+    axes = schema.domain_axes(cell['machine_spec'])
+    if axes:
+        manifest.append(axes)
+    return hashlib.sha1(json.dumps(manifest, sort_keys=True)).hexdigest()
+
+
+def completed_runs(keys):
+    # Include runs still spooled by a previous process.
+    persist.get_writer().flush()
+    return dict(
+        (rec['run_key'], rec['duration'])
+        for rec in get_db('results').find(
+            {'run_key': {'$in': keys}},
+            {'run_key': 1, 'duration': 1},
+        )
+    )
+
+
+def classify(exc):
+    # Anything that is not the workload itself failing is blamed on the
+    # VM or host: boot, ssh, libvirt, qemu-img, file collection.
+    if isinstance(exc, WorkloadError):
+        return 'workload'
+    return 'infrastructure'
+
+
+def record_failure(exc, kind, attempt, cell, tags, key):
+    failure = {
+        'schema_version': schema.SCHEMA_VERSION,
+        'timestamp': str(datetime.datetime.now()),
+        'kind': kind,
+        'attempt': attempt,
+        'error': '%s: %s' % (type(exc).__name__, exc),
+        'traceback': traceback.format_exc(),
+        'test': {
+            'name': cell['test']['func'].__name__,
+            'args': cell['test'].get('args', []),
+            'kwargs': cell['test'].get('kwargs', {}),
+        },
+        'machine_spec': cell['machine_spec'],
+        'cgroup_limit': cell.get('cgroup_limit'),
+        'tags': tags,
+        'run_key': key,
+        'record': getattr(exc, 'record', None),
+    }
+    failure.update(schema.labels(cell['machine_spec']))
+    blobstore.externalize(failure, blobstore.get_store())
+    persist.get_writer().put('failures', failure)
+
+
+class RetryPolicy:
+    def __init__(self):
+        self._failed_runs = {}
+        self.quarantined = set()
+
+    def backoff(self, attempt):
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1)
+
+    def run(self, cell_id, cell, tags, key=None):
+        attempts = {'infrastructure': 0, 'workload': 0}
+        while True:
+            kwargs = dict(cell)
+            if 'perf' in kwargs:
+                # run_test stores the perf output in this dict
+                kwargs['perf'] = dict(cell['perf'])
+            try:
+                record = run_test(tags=tags, run_key=key, **kwargs)
+            except Exception as e:
+                kind = classify(e)
+                attempts[kind] += 1
+                logging.exception('%s failure', kind)
+                record_failure(e, kind, attempts[kind], cell, tags, key)
+                if attempts[kind] >= RETRY_LIMITS[kind]:
+                    break
+                delay = self.backoff(sum(attempts.values()))
+                print 'retrying in %.0fs' % delay
+                time.sleep(delay)
+                continue
+            self._failed_runs[cell_id] = 0
+            return record
+
+        self._failed_runs[cell_id] = self._failed_runs.get(cell_id, 0) + 1
+        if self._failed_runs[cell_id] >= QUARANTINE_AFTER:
+            print 'quarantining cell %s' % cell_id
+            self.quarantined.add(cell_id)
+        return None
+
+
+def fixed_sweep(cells):
+    plan = [
+        (c, i, run_key(cell, i))
+        for c, cell in enumerate(cells)
+        for i in range(ITERS)
+    ]
+    done = completed_runs([key for _, _, key in plan])
+    print '%d/%d runs already completed' % (len(done), len(plan))
+    policy = RetryPolicy()
+    for c, i, key in plan:
+        if key in done or c in policy.quarantined:
+            continue
+        policy.run(c, cells[c], tags=['%d/%d' % (i, ITERS)], key=key)
+
+
+def adaptive_sweep(cells, budget=None):
+    budget = budget or ITERS * len(cells)
+    keys = [[run_key(cell, i) for i in range(MAX_ITERS)] for cell in cells]
+    done = completed_runs(sum(keys, []))
+    print '%d runs already completed' % len(done)
+
+    cell_stats = [RunningStats() for _ in cells]
+    # Iterations still to run per cell; runs that produced no duration
+    # still count against MAX_ITERS.
+    upcoming = [[] for _ in cells]
+    for i, cell_keys in enumerate(keys):
+        for iteration, key in enumerate(cell_keys):
+            if key not in done:
+                upcoming[i].append(iteration)
+            elif done[key] is not None:
+                cell_stats[i].add(done[key])
+
+    policy = RetryPolicy()
+    for _ in range(budget - len(done)):
+        pending = [
+            i for i, st in enumerate(cell_stats)
+            if upcoming[i] and i not in policy.quarantined and (
+                st.n < MIN_ITERS or st.relative_ci() > CI_TARGET
+            )
+        ]
+        if not pending:
+            break
+        warmup = [i for i in pending if cell_stats[i].n < MIN_ITERS]
+        if warmup:
+            i = min(warmup, key=lambda i: cell_stats[i].n)
+        else:
+            i = max(pending, key=lambda i: cell_stats[i].relative_ci())
+
+        iteration = upcoming[i].pop(0)
+        record = policy.run(
+            i,
+            cells[i],
+            tags=['%d/adaptive' % iteration, 'adaptive'],
+            key=keys[i][iteration],
+        )
+        if record is not None:
+            cell_stats[i].add(record['duration'])
+
+    for cell, st, left in zip(cells, cell_stats, upcoming):
+        print '%s %s %s: %d runs, mean %.3f, relative CI %.4f' % (
+            os.path.basename(cell['machine_spec']['template_path']),
+            cell.get('cgroup_limit') or cell['machine_spec']['mem_size'],
+            schema.domain_axes(cell['machine_spec']) or '',
+            MAX_ITERS - len(left), st.mean, st.relative_ci(),
+        )
+
+
+def main(test, test_user, adaptive=False):
+    schema.ensure_indexes(schema.get_db())
+    check_host()
+    collect_stale()
+    cells = sweep_cells(test, test_user)
+    try:
+        if adaptive:
+            adaptive_sweep(cells)
+        else:
+            fixed_sweep(cells)
+    finally:
+        print 'waiting for results to be written'
+        persist.get_writer().flush()
+        reaper.get_reaper().flush()
 
 
 if __name__ == '__main__':
     # main(APACHE_TEST, APACHE_USER)
     main(MEMCACHED_TEST, MEMCACHED_USER)
+    # main(MEMCACHED_TEST, MEMCACHED_USER, adaptive=True)
     # main(NODE_TEST, NODE_USER)
     # main(POSTGRESQL_TEST, POSTGRESQL_USER)
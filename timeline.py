@@ -0,0 +1,103 @@
+import json
+
+import numpy as np
+
+BIN_WIDTH = 1.0
+MAX_LAG = 10
+
+
+def halt_times(rec, records):
+    times = records['timestamp'].astype(np.float64)
+    if rec.get('clock'):
+        return times - rec['clock']['guest_uptime'] + rec['clock']['host_time']
+    # No clock pairing: assume the first halt coincides with the test start.
+    if len(times):
+        return times - times.min() + rec['timing']['start']
+    return times
+
+
+def binned_counter(times, values, edges):
+    return np.diff(np.interp(edges, times, values))
+
+
+def cross_correlation(x, y, max_lag=MAX_LAG):
+    # corr[k] correlates x[t] with y[t + lags[k]]: a peak at a positive
+    # lag means y follows x.
+    x = x - x.mean()
+    y = y - y.mean()
+    denom = np.sqrt((x ** 2).sum() * (y ** 2).sum())
+    max_lag = min(max_lag, len(x) - 1)
+    lags = np.arange(-max_lag, max_lag + 1)
+    if not denom:
+        return lags, np.zeros(len(lags))
+    full = np.correlate(y, x, 'full')
+    center = len(x) - 1
+    return lags, full[center - max_lag:center + max_lag + 1] / denom
+
+
+def lag_summary(lags, corr):
+    peak = int(np.argmax(np.abs(corr)))
+    return {
+        'lags': lags.tolist(),
+        'corr': np.round(corr, 4).tolist(),
+        'zero_lag': float(corr[lags == 0][0]),
+        'peak_lag': int(lags[peak]),
+        'peak_corr': float(corr[peak]),
+    }
+
+
+def align_run(rec, records, sample_times, swap_reads, swap_writes,
+              bin_width=BIN_WIDTH):
+    start = rec['timing']['start']
+    end = rec['timing']['end']
+    edges = np.arange(start, end + bin_width, bin_width)
+    halts = np.histogram(halt_times(rec, records), bins=edges)[0]
+    noirq = np.histogram(
+        halt_times(rec, records[records['preempt'] < 256]), bins=edges
+    )[0]
+    reads = binned_counter(sample_times, swap_reads, edges)
+    writes = binned_counter(sample_times, swap_writes, edges)
+    return {
+        'id': str(rec['_id']),
+        'start': start,
+        'bin_width': bin_width,
+        'series': {
+            'halts': halts.tolist(),
+            'halts_noirq': noirq.tolist(),
+            'swap_read': np.round(reads, 2).tolist(),
+            'swap_write': np.round(writes, 2).tolist(),
+        },
+        'xcorr': {
+            'swap_read': lag_summary(*cross_correlation(halts, reads)),
+            'swap_write': lag_summary(*cross_correlation(halts, writes)),
+        },
+    }
+
+
+def mean_xcorr(runs, series):
+    curves = [run['xcorr'][series] for run in runs]
+    width = min(len(c['lags']) for c in curves)
+    corr = np.array([
+        c['corr'][(len(c['corr']) - width) // 2:][:width] for c in curves
+    ])
+    lags = np.arange(width) - width // 2
+    return lag_summary(lags, corr.mean(axis=0))
+
+
+def export_timeline(path, cells):
+    # cells: {(bucket, mem size): [align_run() results]}
+    out = []
+    for (bucket, mem_size), runs in sorted(cells.items()):
+        if not runs:
+            continue
+        out.append({
+            'bucket': bucket,
+            'memory': mem_size,
+            'xcorr': {
+                'swap_read': mean_xcorr(runs, 'swap_read'),
+                'swap_write': mean_xcorr(runs, 'swap_write'),
+            },
+            'runs': runs,
+        })
+    with open(path, 'w') as f:
+        json.dump(out, f, separators=(',', ':'))
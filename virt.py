@@ -0,0 +1,155 @@
+#!/usr/bin/python
+import logging
+import os
+import threading
+import time
+
+import libvirt
+
+# None picks libvirt's default URI.
+URI = None
+# Ping the daemon every KEEPALIVE_INTERVAL seconds; the connection is
+# closed after KEEPALIVE_COUNT unanswered pings.
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+
+EVENT_NAMES = {
+    libvirt.VIR_DOMAIN_EVENT_DEFINED: 'defined',
+    libvirt.VIR_DOMAIN_EVENT_UNDEFINED: 'undefined',
+    libvirt.VIR_DOMAIN_EVENT_STARTED: 'started',
+    libvirt.VIR_DOMAIN_EVENT_SUSPENDED: 'suspended',
+    libvirt.VIR_DOMAIN_EVENT_RESUMED: 'resumed',
+    libvirt.VIR_DOMAIN_EVENT_STOPPED: 'stopped',
+    libvirt.VIR_DOMAIN_EVENT_SHUTDOWN: 'shutdown',
+    libvirt.VIR_DOMAIN_EVENT_PMSUSPENDED: 'pmsuspended',
+    libvirt.VIR_DOMAIN_EVENT_CRASHED: 'crashed',
+}
+# Events after which the guest is no longer running.
+DOWN_EVENTS = ('stopped', 'shutdown', 'crashed')
+
+_loop_lock = threading.Lock()
+_loop_started = False
+
+
+def start_event_loop():
+    # Has to run before the first connection is opened; keepalives and
+    # event callbacks are dispatched from this thread.
+    global _loop_started
+    with _loop_lock:
+        if _loop_started:
+            return
+        libvirt.virEventRegisterDefaultImpl()
+        thread = threading.Thread(target=_run_event_loop)
+        thread.daemon = True
+        thread.start()
+        _loop_started = True
+
+
+def _run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
+
+class Session(object):
+    # A connection that is reopened when the daemon drops it. Connections
+    # are not shared: see get_conn().
+    def __init__(self, uri=URI):
+        self._uri = uri
+        self._conn = None
+
+    def _open(self):
+        start_event_loop()
+        conn = libvirt.open(self._uri)
+        conn.setKeepAlive(KEEPALIVE_INTERVAL, KEEPALIVE_COUNT)
+        conn.registerCloseCallback(self._closed, None)
+        self.opened(conn)
+        return conn
+
+    def opened(self, conn):
+        pass
+
+    def _closed(self, conn, reason, opaque):
+        logging.warning('libvirt connection to %s closed (reason %d)',
+                        self._uri, reason)
+        self._conn = None
+
+    def connect(self):
+        conn = self._conn
+        if conn is None or not conn.isAlive():
+            conn = self._conn = self._open()
+        return conn
+
+    conn = property(connect)
+
+
+class Events(Session):
+    # Lifecycle events of every domain, kept per domain name until
+    # forgotten, on a connection of their own.
+    def __init__(self, uri=URI):
+        super(Events, self).__init__(uri)
+        self._cond = threading.Condition()
+        self._history = {}
+
+    def opened(self, conn):
+        conn.domainEventRegisterAny(
+            None,
+            libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+            self._lifecycle,
+            None,
+        )
+
+    def _lifecycle(self, conn, dom, event, detail, opaque):
+        with self._cond:
+            self._history.setdefault(dom.name(), []).append({
+                'time': time.time(),
+                'event': EVENT_NAMES.get(event, event),
+                'detail': detail,
+            })
+            self._cond.notify_all()
+
+    def history(self, name):
+        with self._cond:
+            return list(self._history.get(name, []))
+
+    def wait(self, name, events, timeout):
+        # Returns the first of `events` seen for the domain, or None once
+        # `timeout` seconds pass without one.
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                for event in self._history.get(name, []):
+                    if event['event'] in events:
+                        return event
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def forget(self, name):
+        with self._cond:
+            self._history.pop(name, None)
+
+
+_local = threading.local()
+_events = None
+_events_lock = threading.Lock()
+
+
+def get_conn():
+    # One connection per thread (and per process, for forked workers).
+    session = getattr(_local, 'session', None)
+    if session is None or _local.pid != os.getpid():
+        session = _local.session = Session()
+        _local.pid = os.getpid()
+    return session.conn
+
+
+def get_events():
+    # Opens (or reopens) the event connection, so events for domains
+    # started after this returns are not missed.
+    global _events
+    with _events_lock:
+        if _events is None:
+            _events = Events()
+        _events.connect()
+    return _events